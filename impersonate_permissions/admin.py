@@ -1,8 +1,14 @@
 from __future__ import annotations
 
+from typing import Any
+
 from django.contrib import admin
+from django.db import transaction
+from django.db.models import QuerySet
+from django.forms import ModelForm
+from django.http import HttpRequest
 
-from .models import PermissionWindow
+from .models import PermissionWindow, RecurringPermissionWindow
 
 
 class PermissionWindowAdmin(admin.ModelAdmin):
@@ -20,13 +26,58 @@ class PermissionWindowAdmin(admin.ModelAdmin):
         "user__email",
         "user__username",
     )
-    raw_id_fields = ("user",)
-    readonly_fields = ("created_at",)
+    raw_id_fields = ("user", "recurrence")
+    readonly_fields = ("expired_at", "created_at")
 
     def is_active_(self, obj: PermissionWindow) -> bool:
         return obj.is_active
 
     is_active_.boolean = True  # type: ignore
 
+    # saves and deletes go through the model / manager methods, so that the
+    # lifecycle signals are sent (e.g. for audit logs and ASGI connections)
+    def save_model(
+        self, request: HttpRequest, obj: PermissionWindow, form: ModelForm, change: Any
+    ) -> None:
+        if not change or ("is_enabled" in form.changed_data and obj.is_enabled):
+            PermissionWindow.objects.grant(obj)
+        elif "is_enabled" in form.changed_data:
+            obj.disable()
+        else:
+            super().save_model(request, obj, form, change)
+
+    @transaction.atomic
+    def delete_model(self, request: HttpRequest, obj: PermissionWindow) -> None:
+        if obj.is_enabled:
+            obj.disable()
+        super().delete_model(request, obj)
+
+    @transaction.atomic
+    def delete_queryset(self, request: HttpRequest, queryset: QuerySet) -> None:
+        queryset.disable()
+        super().delete_queryset(request, queryset)
+
+
+class RecurringPermissionWindowAdmin(admin.ModelAdmin):
+
+    list_display = (
+        "user",
+        "starts_at",
+        "ends_at",
+        "weekdays",
+        "daily_starts_at",
+        "daily_ends_at",
+        "is_enabled",
+    )
+    search_fields = (
+        "user__first_name",
+        "user__last_name",
+        "user__email",
+        "user__username",
+    )
+    raw_id_fields = ("user",)
+    readonly_fields = ("materialized_until", "created_at")
+
 
 admin.site.register(PermissionWindow, PermissionWindowAdmin)
+admin.site.register(RecurringPermissionWindow, RecurringPermissionWindowAdmin)
@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class ImpersonatePermissionsConfig(AppConfig):
     name = "impersonate_permissions"
     verbose_name = "Impersonate permissions"
+
+    def ready(self) -> None:
+        from .asgi import connect_notify_revoked
+        from .settings import ASGI_REVOCATION_NOTIFY
+
+        if ASGI_REVOCATION_NOTIFY:
+            connect_notify_revoked()
@@ -0,0 +1,262 @@
+"""
+Permission window enforcement for long-lived ASGI connections.
+
+EnforcePermissionWindowMiddleware only runs when an HTTP request is made, so
+an impersonator holding a websocket (or long-poll / SSE) connection open would
+keep access after the window ends. The ASGI middleware in this module resolves
+the window once when the connection is made, and then waits on a single timer
+for the end of the window, and on notification of the window being revoked -
+there is no per-message cost.
+
+Revocations are picked up immediately if made in the same process (via the
+window_revoked signal), and otherwise within ASGI_REVOCATION_POLL_INTERVAL
+seconds, via the cache (the signal receiver is only connected in processes
+that run the middleware, or set ASGI_REVOCATION_NOTIFY). When either fires
+the window is re-checked (the user may have granted a new window), and if
+there is no active window the connection is closed.
+
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+from collections import defaultdict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+
+from .models import PermissionWindow, RecurringPermissionWindow
+from .settings import ASGI_REVOCATION_POLL_INTERVAL
+from .signals import window_revoked
+
+logger = logging.getLogger(__name__)
+
+Scope = Dict[str, Any]
+Message = Dict[str, Any]
+Receive = Callable[[], Awaitable[Message]]
+Send = Callable[[Message], Awaitable[None]]
+ASGIApp = Callable[[Scope, Receive, Send], Awaitable[None]]
+
+# websocket close code sent when the window ends
+CLOSE_CODE = 4403
+
+# seconds to wait for the app to handle being disconnected, before cancelling it
+DISCONNECT_TIMEOUT = 5
+
+# windows being watched in this process, by window id
+Watcher = Tuple[asyncio.AbstractEventLoop, asyncio.Event]
+_watchers: Dict[int, Set[Watcher]] = defaultdict(set)
+
+
+def revoked_cache_key(window_id: int) -> str:
+    return f"impersonate_permissions:revoked:{window_id}"
+
+
+def notify_revoked(sender: Any, window_ids: List[int], **kwargs: Any) -> None:
+    """Notify connections that windows have been revoked (signal receiver)."""
+    for window_id in window_ids:
+        for loop, event in list(_watchers.get(window_id, ())):
+            loop.call_soon_threadsafe(event.set)
+    if not ASGI_REVOCATION_POLL_INTERVAL:
+        return
+    # this runs after the revocation has been committed, so a cache outage
+    # must not turn it into an error - connections elsewhere will still be
+    # closed when their window ends.
+    try:
+        # keep the key long enough for every connection to have polled
+        timeout = ASGI_REVOCATION_POLL_INTERVAL * 10
+        cache.set_many({revoked_cache_key(i): True for i in window_ids}, timeout)
+    except Exception:  # pylint: disable=broad-except
+        logger.warning("Unable to notify ASGI connections of revocation", exc_info=True)
+
+
+def connect_notify_revoked() -> None:
+    """Connect notify_revoked to the window_revoked signal."""
+    window_revoked.connect(notify_revoked, dispatch_uid="asgi_notify_revoked")
+
+
+@sync_to_async
+def resolve_window(scope: Scope) -> Tuple[Optional[int], Optional[PermissionWindow]]:
+    """Return impersonated user id and their active window."""
+    session = scope.get("session")
+    user = scope.get("user")
+    if not (session and user and user.is_authenticated):
+        return None, None
+    user_id = session.get("_impersonate")
+    if user_id is None:
+        return None, None
+    windows = PermissionWindow.objects.filter(user_id=user_id)
+    window = windows.active().last()
+    recurrences = RecurringPermissionWindow.objects.filter(user_id=user_id)
+    if window is None and recurrences.materialize():
+        # the current occurrence of a recurring window may not exist yet
+        window = windows.active().last()
+    return user_id, window
+
+
+async def _wait_for_revocation(window_id: int, event: asyncio.Event) -> None:
+    """Return when window is revoked in this process, or found in the cache."""
+    if not ASGI_REVOCATION_POLL_INTERVAL:
+        await event.wait()
+        return
+    key = revoked_cache_key(window_id)
+    while True:
+        try:
+            await asyncio.wait_for(event.wait(), ASGI_REVOCATION_POLL_INTERVAL)
+            return
+        except asyncio.TimeoutError:
+            if await sync_to_async(cache.get)(key):
+                return
+
+
+async def watch_window(scope: Scope, window: Optional[PermissionWindow]) -> None:
+    """Return when there is no longer an active window for the connection."""
+    loop = asyncio.get_running_loop()
+    while window:
+        event = asyncio.Event()
+        watcher = (loop, event)
+        _watchers[window.id].add(watcher)
+        try:
+            await asyncio.wait_for(
+                _wait_for_revocation(window.id, event),
+                max(window.ttl.total_seconds(), 0),
+            )
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            _watchers[window.id].discard(watcher)
+            if not _watchers[window.id]:
+                del _watchers[window.id]
+        # the window has ended or been revoked - check for a new one
+        _, window = await resolve_window(scope)
+
+
+class DisconnectableReceive:
+    """Wrap an ASGI receive callable, so that the app can be disconnected."""
+
+    def __init__(self, receive: Receive, scope: Scope) -> None:
+        self.receive = receive
+        if scope["type"] == "websocket":
+            self.message = {"type": "websocket.disconnect", "code": CLOSE_CODE}
+        else:
+            self.message = {"type": "http.disconnect"}
+        self.disconnected = asyncio.Event()
+        # the next message from the server, kept across calls so that none
+        # are lost if the app stops waiting for one
+        self.pending: Optional[asyncio.Future] = None
+
+    async def __call__(self) -> Message:
+        if self.pending is None and not self.disconnected.is_set():
+            self.pending = asyncio.ensure_future(self.receive())
+        waiters: Set[asyncio.Future] = {asyncio.ensure_future(self.disconnected.wait())}
+        if self.pending:
+            waiters.add(self.pending)
+        try:
+            await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for waiter in waiters - {self.pending}:
+                waiter.cancel()
+        if self.pending and self.pending.done():
+            message, self.pending = self.pending.result(), None
+            return message
+        return self.message
+
+    def disconnect(self) -> None:
+        """Return a disconnect message to the app, now and from now on."""
+        self.disconnected.set()
+        if self.pending:
+            self.pending.cancel()
+            self.pending = None
+
+
+class EnforcePermissionWindowASGIMiddleware:
+    """
+    Close long-lived impersonated connections when their window ends.
+
+    This must be inside the session and auth middleware (e.g. Channels'
+    AuthMiddlewareStack), as it reads `scope["session"]` and `scope["user"]`.
+    Only websocket connections are watched by default - pass `scope_types`
+    to include long-poll / SSE "http" connections.
+
+    """
+
+    def __init__(self, app: ASGIApp, scope_types: Tuple[str, ...] = ("websocket",)):
+        self.app = app
+        self.scope_types = scope_types
+        connect_notify_revoked()
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] not in self.scope_types:
+            return await self.app(scope, receive, send)
+
+        user_id, window = await resolve_window(scope)
+        if user_id is None:
+            return await self.app(scope, receive, send)
+
+        if window is None:
+            return await self.close(scope, send, response_started=False)
+
+        await self.run_watched(scope, receive, send, window)
+
+    async def run_watched(
+        self, scope: Scope, receive: Receive, send: Send, window: PermissionWindow
+    ) -> None:
+        """Run the app, closing the connection when the window ends."""
+        closed = False
+        response_started = False
+
+        async def guarded_send(message: Message) -> None:
+            nonlocal response_started
+            if closed:
+                return
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        watched_receive = DisconnectableReceive(receive, scope)
+        app_task = asyncio.ensure_future(self.app(scope, watched_receive, guarded_send))
+        watch_task = asyncio.ensure_future(watch_window(scope, window))
+        try:
+            done, _ = await asyncio.wait(
+                {app_task, watch_task}, return_when=asyncio.FIRST_COMPLETED
+            )
+            if app_task in done:
+                return app_task.result()
+
+            if watch_task.exception():
+                # fail closed, but make sure we know about it
+                logger.error(
+                    "Error watching permission window", exc_info=watch_task.exception()
+                )
+            closed = True
+            await self.close(scope, send, response_started)
+            await self.disconnect(app_task, watched_receive)
+        finally:
+            # asyncio.wait does not cancel the tasks if this coroutine is
+            # cancelled (e.g. by the server on shutdown)
+            for task in (app_task, watch_task):
+                if not task.done():
+                    task.cancel()
+            watched_receive.disconnect()
+
+    async def disconnect(
+        self, app_task: asyncio.Future, receive: DisconnectableReceive
+    ) -> None:
+        """Tell the app that the client has disconnected, and wait for it."""
+        # the app must be allowed to clean up (e.g. leave Channels groups), so
+        # it is only cancelled if it does not finish after the disconnect.
+        receive.disconnect()
+        try:
+            await asyncio.wait_for(app_task, DISCONNECT_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning("ASGI app did not exit after disconnect, cancelled")
+
+    async def close(self, scope: Scope, send: Send, response_started: bool) -> None:
+        """Close the connection."""
+        if scope["type"] == "websocket":
+            await send({"type": "websocket.close", "code": CLOSE_CODE})
+            return
+        if not response_started:
+            await send({"type": "http.response.start", "status": 403, "headers": []})
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
@@ -1,17 +1,24 @@
-from typing import Dict, Optional, Union
+from typing import Any, Dict
 
-from django.conf import settings
 from django.http import HttpRequest
+from django.utils.functional import SimpleLazyObject
 
+from .models import get_active_window
 
-def impersonation(
-    request: HttpRequest,
-) -> Dict[str, Union[bool, Optional[settings.AUTH_USER_MODEL]]]:
+
+def impersonation(request: HttpRequest) -> Dict[str, Any]:
     """Add impersonate info to template context."""
     if request.user.is_authenticated and request.user.is_impersonate:
         return {
             "is_impersonate": True,
             "impersonator": request.real_user,
             "impersonating": request.user,
+            # lazy, and shares the window already fetched by the middleware
+            "permission_window": SimpleLazyObject(lambda: get_active_window(request)),
         }
-    return {"is_impersonate": False, "impersonator": None, "impersonating": None}
+    return {
+        "is_impersonate": False,
+        "impersonator": None,
+        "impersonating": None,
+        "permission_window": None,
+    }
@@ -1,7 +1,7 @@
 from __future__ import annotations
 
 import logging
-from typing import Any, Callable, Dict
+from typing import Any, Callable, Dict, Optional
 
 from django.conf import settings as django_settings
 from django.contrib import messages
@@ -13,7 +13,10 @@ from django.template.loader import render_to_string
 from django.urls import reverse
 from django.utils import timezone
 
+from .models import get_active_window
+from .profiling import profile_render, profiled
 from .settings import PERMISSION_EXPIRY_WARNING_INTERVAL
+from .storage import LAZY_MESSAGE_TAG, LazyMessageStorageMixin, encode_lazy_message
 
 logger = logging.getLogger(__name__)
 
@@ -21,9 +24,21 @@ logger = logging.getLogger(__name__)
 def add_message(
     request: HttpRequest, level: int, template_name: str, context: Dict[str, Any] = None
 ) -> None:
-    """Add templated message using messages app."""
+    """
+    Add templated message using messages app.
+
+    If the request message storage supports lazy messages the template is
+    not rendered here, and only the template name and a minimal context are
+    stored - see `impersonate_permissions.storage`.
+
+    """
     template = f"impersonate_permissions/{template_name}.tpl"
-    message = render_to_string(template, context=context)
+    if isinstance(getattr(request, "_messages", None), LazyMessageStorageMixin):
+        message = encode_lazy_message(template, context)
+        messages.add_message(request, level, message, extra_tags=LAZY_MESSAGE_TAG)
+        return
+    with profile_render(request):
+        message = render_to_string(template, context=context)
     messages.add_message(request, level, message)
 
 
@@ -33,16 +48,24 @@ class EnforcePermissionWindowMiddleware:
     def __init__(self, get_response: Callable[[HttpRequest], HttpResponse]):
         self.get_response = get_response
 
-    def __call__(self, request: HttpRequest) -> HttpResponse:  # noqa: C901
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        return self.process_request(request) or self.get_response(request)
+
+    @profiled
+    def process_request(self, request: HttpRequest) -> Optional[HttpResponse]:
+        """Return redirect to impersonate-stop if permission has expired."""
         if not request.user.is_impersonate:
-            return self.get_response(request)
+            return None
 
         # don't interfere with this page, otherwise we get into loop
         if request.path == reverse("impersonate-stop"):
-            return self.get_response(request)
+            return None
 
         # the user being impersonated is in the users_impersonable
-        window = request.user.permission_windows.active().last()
+        window = get_active_window(request)
+        if window is None and request.user.recurring_permission_windows.materialize():
+            # the current occurrence of a recurring window may not exist yet
+            window = get_active_window(request, refresh=True)
         if window:
             level = (
                 messages.INFO
@@ -51,7 +74,7 @@ class EnforcePermissionWindowMiddleware:
             )
             context = {"window": window}
             add_message(request, level, "impersonating", context=context)
-            return self.get_response(request)
+            return None
 
         add_message(request, messages.INFO, "expired")
         return redirect(reverse("impersonate-stop"))
@@ -63,18 +86,22 @@ class ImpersonationAlertMiddleware:
     def __init__(self, get_response: Callable[[HttpRequest], HttpResponse]):
         self.get_response = get_response
 
-    def __call__(self, request: HttpRequest) -> HttpResponse:  # noqa: C901
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        self.process_request(request)
+        return self.get_response(request)
 
+    @profiled
+    def process_request(self, request: HttpRequest) -> None:
+        """Add message for each open impersonation session."""
         if request.user.is_anonymous:
-            return self.get_response(request)
+            return
 
         if request.user.is_impersonate:
-            return self.get_response(request)
+            return
 
         for session in self.open_impersonation_sessions(request.user):
             context = {"impersonator": session.impersonator}
             add_message(request, messages.INFO, "impersonated", context=context)
-        return self.get_response(request)
 
     def open_impersonation_sessions(
         self, user: django_settings.AUTH_USER_MODEL
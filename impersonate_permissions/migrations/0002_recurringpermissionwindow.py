@@ -0,0 +1,111 @@
+# Generated by Django 3.1.14 on 2026-10-19 15:32
+
+import django.core.validators
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("impersonate_permissions", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RecurringPermissionWindow",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "starts_at",
+                    models.DateTimeField(
+                        default=django.utils.timezone.now,
+                        help_text="When the recurrence begins.",
+                    ),
+                ),
+                (
+                    "ends_at",
+                    models.DateTimeField(help_text="When the recurrence ends."),
+                ),
+                (
+                    "weekdays",
+                    models.CharField(
+                        default="01234",
+                        help_text="Days of the week (0=Monday) on which the window recurs.",
+                        max_length=7,
+                        validators=[
+                            django.core.validators.RegexValidator("^[0-6]{1,7}$")
+                        ],
+                    ),
+                ),
+                (
+                    "daily_starts_at",
+                    models.TimeField(help_text="When each occurrence begins."),
+                ),
+                (
+                    "daily_ends_at",
+                    models.TimeField(help_text="When each occurrence ends."),
+                ),
+                (
+                    "is_enabled",
+                    models.BooleanField(
+                        default=True, help_text="Kill switch for the recurring window."
+                    ),
+                ),
+                (
+                    "materialized_until",
+                    models.DateTimeField(
+                        blank=True,
+                        help_text="Occurrences have been created up to this timestamp.",
+                        null=True,
+                    ),
+                ),
+                (
+                    "created_at",
+                    models.DateTimeField(
+                        default=django.utils.timezone.now,
+                        help_text="When the database record was created.",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="permissionwindow",
+            index=models.Index(
+                fields=["window_ends_at", "window_starts_at", "is_enabled"],
+                name="permission_window_active_idx",
+            ),
+        ),
+        migrations.AddField(
+            model_name="recurringpermissionwindow",
+            name="user",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="recurring_permission_windows",
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+        migrations.AddField(
+            model_name="permissionwindow",
+            name="recurrence",
+            field=models.ForeignKey(
+                blank=True,
+                help_text="The recurring window that this window is an occurrence of.",
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="windows",
+                to="impersonate_permissions.recurringpermissionwindow",
+            ),
+        ),
+    ]
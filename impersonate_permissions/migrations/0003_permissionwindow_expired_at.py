@@ -0,0 +1,22 @@
+# Generated by Django 3.1.14 on 2026-10-19 15:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("impersonate_permissions", "0002_recurringpermissionwindow"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="permissionwindow",
+            name="expired_at",
+            field=models.DateTimeField(
+                blank=True,
+                help_text="When the window was marked as expired.",
+                null=True,
+            ),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 3.1.14 on 2026-10-19 15:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("impersonate_permissions", "0003_permissionwindow_expired_at"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="permissionwindow",
+            index=models.Index(
+                fields=["user", "is_enabled", "window_ends_at"],
+                name="permission_window_user_idx",
+            ),
+        ),
+    ]
@@ -1,15 +1,21 @@
 from __future__ import annotations
 
 import datetime
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple
 
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core.exceptions import PermissionDenied
+from django.core.validators import RegexValidator
 from django.db import models, transaction
+from django.dispatch import Signal
 from django.http import HttpRequest
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
-from .settings import DEFAULT_PERMISSION_EXPIRY
+from .profiling import profile_window
+from .settings import DEFAULT_PERMISSION_EXPIRY, RECURRING_WINDOW_HORIZON
+from .signals import send_on_commit, window_expired, window_granted, window_revoked
 
 User = get_user_model()
 
@@ -25,6 +31,70 @@ def users_impersonable(request: HttpRequest) -> models.QuerySet:
     return User.objects.filter(id__in=user_ids).order_by("first_name", "last_name")
 
 
+# (last_name, first_name, id) of the last user on the previous page
+Cursor = Tuple[str, str, int]
+
+
+def users_impersonable_cursor(user: settings.AUTH_USER_MODEL) -> Cursor:
+    """Return cursor used to fetch the page after `user`."""
+    return (user.last_name, user.first_name, user.pk)
+
+
+def users_impersonable_page(
+    request: HttpRequest, after: Optional[Cursor] = None, search: str = ""
+) -> models.QuerySet:
+    """
+    Return users who can be impersonated, for keyset pagination.
+
+    Users are ordered by (last_name, first_name, id), and only those after
+    the `after` cursor are returned, so each page is an index range scan
+    rather than an ever-growing OFFSET - slice the result to get a page, and
+    pass `users_impersonable_cursor(page[-1])` as `after` for the next one.
+    If `search` is set, only users whose first name, last name or email
+    begins with it are returned.
+
+    """
+    users = users_impersonable(request).order_by("last_name", "first_name", "id")
+    if after:
+        last_name, first_name, user_id = after
+        # the leading bound lets the (last_name, first_name, id) index seek to
+        # the cursor - most planners cannot do that from the OR alone.
+        users = users.filter(last_name__gte=last_name).filter(
+            models.Q(last_name__gt=last_name)
+            | models.Q(last_name=last_name, first_name__gt=first_name)
+            | models.Q(last_name=last_name, first_name=first_name, id__gt=user_id)
+        )
+    if search:
+        users = users.filter(
+            models.Q(last_name__istartswith=search)
+            | models.Q(first_name__istartswith=search)
+            | models.Q(email__istartswith=search)
+        )
+    return users
+
+
+def get_active_window(
+    request: HttpRequest, refresh: bool = False
+) -> Optional[PermissionWindow]:
+    """
+    Return the active PermissionWindow for request.user, if any.
+
+    The window is looked up at most once per request (unless `refresh` is
+    True), and shared by the middleware, context processor and views. If
+    profiling, the lookup is recorded as coming from the "request" memo or
+    the "database".
+
+    """
+    cached = getattr(request, "_permission_window", None)
+    if cached and cached[0] == request.user.pk and not refresh:
+        profile_window(request, cached[1], "request")
+        return cached[1]
+    window = request.user.permission_windows.active().last()
+    request._permission_window = (request.user.pk, window)
+    profile_window(request, window, "database")
+    return window
+
+
 class PermissionWindowQuerySet(models.QuerySet):
     def active(self) -> PermissionWindowQuerySet:
         """Return active and enabled PermissionWindows."""
@@ -33,17 +103,77 @@ class PermissionWindowQuerySet(models.QuerySet):
             window_starts_at__lte=now, window_ends_at__gte=now, is_enabled=True
         ).order_by("window_starts_at", "window_ends_at")
 
+    def active_for_users(
+        self, user_ids: Iterable[int]
+    ) -> Dict[int, Optional[PermissionWindow]]:
+        """Return mapping of user id to active window (or None), in one query."""
+        # ids may be strings (e.g. from request.POST), but are matched and
+        # returned as the type of window.user_id
+        to_python = self.model._meta.get_field("user").target_field.to_python
+        user_ids = [to_python(user_id) for user_id in user_ids]
+        windows: Dict[int, Optional[PermissionWindow]] = dict.fromkeys(user_ids)
+        # ordered by start, so the last window per user wins, as with .last()
+        for window in self.active().filter(user_id__in=user_ids):
+            windows[window.user_id] = window
+        return windows
+
+    def require_active_for_users(
+        self, user_ids: Iterable[int], raise_exception: bool = True
+    ) -> Dict[int, PermissionWindow]:
+        """
+        Return mapping of user id to active window for users with consent.
+
+        If any user has no active window PermissionDenied is raised, unless
+        `raise_exception` is False, in which case the user is omitted.
+
+        """
+        windows = self.active_for_users(user_ids)
+        missing = [user_id for user_id, window in windows.items() if window is None]
+        if missing and raise_exception:
+            raise PermissionDenied(f"Users have no active permission window: {missing}")
+        return {user_id: w for user_id, w in windows.items() if w is not None}
+
+    def expired(self) -> PermissionWindowQuerySet:
+        """Return enabled PermissionWindows that have run out, but not expired."""
+        return self.filter(
+            window_ends_at__lt=timezone.now(), is_enabled=True, expired_at__isnull=True
+        )
+
+    @transaction.atomic
+    def _update(self, signal: Signal, **kwargs: Any) -> None:
+        window_ids = list(self.select_for_update().values_list("id", flat=True))
+        # update exactly the rows locked (and signalled), not a re-run of the
+        # filter, which could match rows committed in the meantime
+        self.model._default_manager.filter(pk__in=window_ids).update(**kwargs)
+        send_on_commit(signal, self.model, window_ids)
+
     def disable(self) -> None:
-        """Disable all objects in queryset."""
-        self.update(is_enabled=False)
+        """Disable all objects in queryset, sending window_revoked on commit."""
+        self.filter(is_enabled=True)._update(window_revoked, is_enabled=False)
+
+    def expire(self) -> None:
+        """Mark expired objects in queryset, sending window_expired on commit."""
+        self.expired()._update(window_expired, expired_at=timezone.now())
 
 
 class PermissionWindowManager(models.Manager):
-    @transaction.atomic
     def create(self, user: settings.AUTH_USER_MODEL, **kwargs: str) -> PermissionWindow:
-        """Create new PermissionWindow and disable any existing windows."""
-        user.permission_windows.active().disable()
-        return super().create(user=user, **kwargs)
+        """Create new PermissionWindow and disable any overlapping windows."""
+        return self.grant(self.model(user=user, **kwargs))
+
+    @transaction.atomic
+    def grant(self, window: PermissionWindow) -> PermissionWindow:
+        """Save (new or re-enabled) window, and disable any overlapping windows."""
+        # recurrences are left enabled - only their overlapping occurrences
+        # are disabled, and later ones are kept.
+        window.user.permission_windows.filter(
+            is_enabled=True,
+            window_starts_at__lt=window.window_ends_at,
+            window_ends_at__gt=window.window_starts_at,
+        ).exclude(id=window.id).disable()
+        window.save(using=self.db)
+        send_on_commit(window_granted, self.model, [window.id])
+        return window
 
 
 class PermissionWindow(models.Model):
@@ -72,9 +202,37 @@ class PermissionWindow(models.Model):
     created_at = models.DateTimeField(
         default=timezone.now, help_text=_("When the database record was created.")
     )
+    recurrence = models.ForeignKey(
+        "RecurringPermissionWindow",
+        on_delete=models.CASCADE,
+        related_name="windows",
+        blank=True,
+        null=True,
+        help_text=_("The recurring window that this window is an occurrence of."),
+    )
+    expired_at = models.DateTimeField(
+        blank=True,
+        null=True,
+        help_text=_("When the window was marked as expired."),
+    )
 
     objects = PermissionWindowManager.from_queryset(PermissionWindowQuerySet)()
 
+    class Meta:
+        indexes = [
+            # supports the range check in PermissionWindowQuerySet.active
+            models.Index(
+                fields=["window_ends_at", "window_starts_at", "is_enabled"],
+                name="permission_window_active_idx",
+            ),
+            # supports user.permission_windows.active() - the FK index alone
+            # would scan all of the user's windows, which grows with each grant
+            models.Index(
+                fields=["user", "is_enabled", "window_ends_at"],
+                name="permission_window_user_idx",
+            ),
+        ]
+
     def __str__(self) -> str:
         return f"Impersonate permissions window [{self.id}] for {self.user}"
 
@@ -97,3 +255,166 @@ class PermissionWindow(models.Model):
         """Disable the window by setting enabled to False."""
         self.is_enabled = False
         self.save()
+        send_on_commit(window_revoked, self.__class__, [self.id])
+
+
+def make_local(day: datetime.date, time: datetime.time) -> datetime.datetime:
+    """
+    Return aware datetime for the day and time in the current timezone.
+
+    Times that are skipped by a DST transition are treated as standard time
+    (i.e. they move forward an hour), and times that occur twice resolve to
+    the later, standard time, occurrence.
+
+    """
+    return timezone.make_aware(datetime.datetime.combine(day, time), is_dst=False)
+
+
+class RecurringPermissionWindowQuerySet(models.QuerySet):
+    def materialize(
+        self, horizon: datetime.timedelta = RECURRING_WINDOW_HORIZON
+    ) -> int:
+        """Create window occurrences up to `horizon` from now, return count."""
+        return sum(r.materialize(horizon) for r in self.filter(is_enabled=True))
+
+    @transaction.atomic
+    def disable(self) -> None:
+        """Disable recurrences, and any current or future occurrences."""
+        enabled = self.filter(is_enabled=True)
+        recurrence_ids = list(enabled.select_for_update().values_list("id", flat=True))
+        if not recurrence_ids:
+            return
+        enabled.update(is_enabled=False)
+        PermissionWindow.objects.filter(
+            recurrence_id__in=recurrence_ids, window_ends_at__gte=timezone.now()
+        ).disable()
+
+
+class RecurringPermissionWindow(models.Model):
+    """
+    Maintain recurring user permission for impersonation.
+
+    This class stores a standing grant of permission - e.g. during business
+    hours for the next 90 days. Each occurrence is stored as a PermissionWindow
+    (linked via `recurrence`), and occurrences are created a bounded horizon
+    at a time by `materialize`, so that enforcement is unchanged.
+
+    Daily start and end times are in the current timezone (see `make_local`
+    for how DST transitions are handled); if the end time is not after the
+    start time the occurrence ends the following day.
+
+    """
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name="recurring_permission_windows",
+    )
+    starts_at = models.DateTimeField(
+        default=timezone.now, help_text=_("When the recurrence begins.")
+    )
+    ends_at = models.DateTimeField(help_text=_("When the recurrence ends."))
+    weekdays = models.CharField(
+        max_length=7,
+        default="01234",
+        validators=[RegexValidator(r"^[0-6]{1,7}$")],
+        help_text=_("Days of the week (0=Monday) on which the window recurs."),
+    )
+    daily_starts_at = models.TimeField(help_text=_("When each occurrence begins."))
+    daily_ends_at = models.TimeField(help_text=_("When each occurrence ends."))
+    is_enabled = models.BooleanField(
+        default=True, help_text=_("Kill switch for the recurring window.")
+    )
+    materialized_until = models.DateTimeField(
+        blank=True,
+        null=True,
+        help_text=_("Occurrences have been created up to this timestamp."),
+    )
+    created_at = models.DateTimeField(
+        default=timezone.now, help_text=_("When the database record was created.")
+    )
+
+    objects = RecurringPermissionWindowQuerySet.as_manager()
+
+    def __str__(self) -> str:
+        return f"Recurring impersonate permissions window [{self.id}] for {self.user}"
+
+    def __repr__(self) -> str:
+        return f"<RecurringPermissionWindow id={self.id} user_id={self.user_id}>"
+
+    def occurrences(
+        self, start: datetime.datetime, end: datetime.datetime
+    ) -> Iterator[Tuple[datetime.datetime, datetime.datetime]]:
+        """Yield (start, end) of each occurrence beginning in [start, end)."""
+        day = max(start, self.starts_at - datetime.timedelta(days=1))
+        day = timezone.localtime(day).date()
+        last_day = timezone.localtime(min(end, self.ends_at)).date()
+        overnight = self.daily_ends_at <= self.daily_starts_at
+        while day <= last_day:
+            if str(day.weekday()) in self.weekdays:
+                occurs_at = make_local(day, self.daily_starts_at)
+                ends_at = make_local(
+                    day + datetime.timedelta(days=int(overnight)), self.daily_ends_at
+                )
+                if start <= occurs_at < end:
+                    # clip the occurrence to the bounds of the recurrence
+                    occurs_at = max(occurs_at, self.starts_at)
+                    ends_at = min(ends_at, self.ends_at)
+                    if occurs_at < ends_at:
+                        yield occurs_at, ends_at
+            day += datetime.timedelta(days=1)
+
+    @transaction.atomic
+    def materialize(
+        self, horizon: datetime.timedelta = RECURRING_WINDOW_HORIZON
+    ) -> int:
+        """Create window occurrences up to `horizon` from now, return count."""
+        now = timezone.now()
+        limit = min(now + horizon, self.ends_at)
+        # occurrences last less than a day, so anything that began more than a
+        # day ago has ended - this also picks up an occurrence that began
+        # before the recurrence itself did.
+        start = max(self.starts_at, now) - datetime.timedelta(days=1)
+        # lock the recurrence, so that concurrent calls (e.g. from the
+        # middleware) cannot both create the same occurrences.
+        locked = RecurringPermissionWindow.objects.select_for_update().get(id=self.id)
+        if not locked.is_enabled:
+            return 0
+        if locked.materialized_until:
+            start = max(start, locked.materialized_until)
+        if start >= limit:
+            return 0
+        # saved one at a time (rather than bulk_create) so that the ids are
+        # available on every database, to send window_granted.
+        windows = list(self._new_windows(start, limit))
+        for window in windows:
+            window.save()
+        window_ids = [window.id for window in windows]
+        send_on_commit(window_granted, PermissionWindow, window_ids)
+        self.materialized_until = limit
+        self.save(update_fields=["materialized_until"])
+        return len(window_ids)
+
+    def _new_windows(
+        self, start: datetime.datetime, end: datetime.datetime
+    ) -> Iterator[PermissionWindow]:
+        # a user has at most one enabled window at a time, so occurrences that
+        # overlap any other enabled window (e.g. a one-off grant) are skipped.
+        existing = list(
+            PermissionWindow.objects.select_for_update()
+            .filter(user_id=self.user_id, is_enabled=True, window_ends_at__gt=start)
+            .values_list("window_starts_at", "window_ends_at")
+        )
+        for occurs_at, ends_at in self.occurrences(start, end):
+            if not any(s < ends_at and occurs_at < e for s, e in existing):
+                yield PermissionWindow(
+                    user_id=self.user_id,
+                    recurrence=self,
+                    window_starts_at=occurs_at,
+                    window_ends_at=ends_at,
+                )
+
+    def disable(self) -> None:
+        """Disable the recurrence, and any current or future occurrences."""
+        RecurringPermissionWindow.objects.filter(id=self.id).disable()
+        self.is_enabled = False
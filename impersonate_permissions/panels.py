@@ -0,0 +1,33 @@
+"""
+Django Debug Toolbar panel for impersonation permission profiling.
+
+This module requires `django-debug-toolbar`, which is not a dependency of
+this app, and should only be referenced from DEBUG_TOOLBAR_PANELS.
+
+"""
+from __future__ import annotations
+
+from debug_toolbar.panels import Panel
+from django.http.request import HttpRequest
+from django.http.response import HttpResponse
+
+from .profiling import get_profile
+
+
+class PermissionsPanel(Panel):
+    """Display the PermissionsProfile recorded for the request."""
+
+    title = "Impersonate permissions"
+    template = "impersonate_permissions/debug_toolbar/panel.html"
+
+    @property
+    def nav_subtitle(self) -> str:
+        stats = self.get_stats()
+        if not stats:
+            return "Profiling disabled"
+        return f"{stats['query_count']} queries"
+
+    def generate_stats(self, request: HttpRequest, response: HttpResponse) -> None:
+        profile = get_profile(request)
+        if profile:
+            self.record_stats(profile.as_dict())
@@ -0,0 +1,138 @@
+"""
+Optional profiling of impersonation permission enforcement.
+
+Profiling is enabled by setting IMPERSONATE["PROFILE_PERMISSIONS"] to True
+and adding `ProfilePermissionsMiddleware` to MIDDLEWARE, before any of the
+other middleware in this app. If the setting is False the middleware removes
+itself from the stack (MiddlewareNotUsed), and the instrumentation in this
+app reduces to a single attribute lookup per request.
+
+"""
+from __future__ import annotations
+
+import functools
+import json
+import time
+from contextlib import ExitStack, contextmanager, nullcontext
+from typing import Any, Callable, ContextManager, Dict, Iterator, List, Optional
+
+from django.conf import settings as django_settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.http.request import HttpRequest
+from django.http.response import HttpResponse
+
+from .settings import PROFILE_PERMISSIONS
+
+PROFILE_HEADER = "X-Impersonate-Permissions-Profile"
+
+
+class PermissionsProfile:
+    """Record of what this app did during a single request."""
+
+    def __init__(self) -> None:
+        # (name, duration) of each middleware that ran
+        self.middleware: List[Dict[str, Any]] = []
+        # (sql, duration) of each query issued by this app
+        self.queries: List[Dict[str, Any]] = []
+        self.window_id: Optional[int] = None
+        self.window_source: Optional[str] = None
+        self.render_time: float = 0.0
+
+    def _execute(
+        self, execute: Callable, sql: str, params: Any, many: bool, context: Dict
+    ) -> Any:
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append({"sql": sql, "duration": time.perf_counter() - start})
+
+    @contextmanager
+    def record_middleware(self, name: str) -> Iterator[None]:
+        """Time a middleware, capturing any queries it issues."""
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(self._execute))
+            try:
+                yield
+            finally:
+                self.middleware.append(
+                    {"name": name, "duration": time.perf_counter() - start}
+                )
+
+    @contextmanager
+    def record_render(self) -> Iterator[None]:
+        """Time message template rendering."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.render_time += time.perf_counter() - start
+
+    def record_window(self, window: Any, source: str) -> None:
+        """Record the window matched by the latest lookup, and its source."""
+        self.window_id = window.id if window else None
+        self.window_source = source
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "middleware": self.middleware,
+            "window_id": self.window_id,
+            "window_source": self.window_source,
+            "queries": self.queries,
+            "query_count": len(self.queries),
+            "query_time": sum(q["duration"] for q in self.queries),
+            "render_time": self.render_time,
+        }
+
+
+def get_profile(request: HttpRequest) -> Optional[PermissionsProfile]:
+    """Return the request profile, or None if profiling is not enabled."""
+    return getattr(request, "_permissions_profile", None)
+
+
+def profile_render(request: HttpRequest) -> ContextManager:
+    """Return context manager used to time message rendering."""
+    profile = get_profile(request)
+    return profile.record_render() if profile else nullcontext()
+
+
+def profile_window(request: HttpRequest, window: Any, source: str) -> None:
+    """Record the window matched for the request, if profiling."""
+    profile = get_profile(request)
+    if profile:
+        profile.record_window(window, source)
+
+
+def profiled(
+    func: Callable[[Any, HttpRequest], Optional[HttpResponse]]
+) -> Callable[[Any, HttpRequest], Optional[HttpResponse]]:
+    """Decorate middleware method to record it in the request profile."""
+
+    @functools.wraps(func)
+    def wrapper(self: Any, request: HttpRequest) -> Optional[HttpResponse]:
+        profile = get_profile(request)
+        if profile is None:
+            return func(self, request)
+        with profile.record_middleware(self.__class__.__name__):
+            return func(self, request)
+
+    return wrapper
+
+
+class ProfilePermissionsMiddleware:
+    """Attach a PermissionsProfile to the request, and report it in DEBUG."""
+
+    def __init__(self, get_response: Callable[[HttpRequest], HttpResponse]):
+        if not PROFILE_PERMISSIONS:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        request._permissions_profile = profile = PermissionsProfile()
+        response = self.get_response(request)
+        if django_settings.DEBUG:
+            response[PROFILE_HEADER] = json.dumps(profile.as_dict())
+        return response
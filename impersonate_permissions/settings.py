@@ -16,3 +16,22 @@ DISPLAY_PERMISSION_MESSAGES: bool = settings.IMPERSONATE.get(
 PERMISSION_EXPIRY_WARNING_INTERVAL = datetime.timedelta(
     minutes=settings.IMPERSONATE.get("PERMISSION_EXPIRY_WARNING_INTERVAL", 10)
 )
+
+# Set to True to enable ProfilePermissionsMiddleware
+PROFILE_PERMISSIONS: bool = settings.IMPERSONATE.get("PROFILE_PERMISSIONS", False)
+
+# Number of days ahead for which recurring window occurrences are created
+RECURRING_WINDOW_HORIZON = datetime.timedelta(
+    days=settings.IMPERSONATE.get("RECURRING_WINDOW_HORIZON", 7)
+)
+
+# Interval, in seconds, at which ASGI connections poll the cache for revoked
+# windows (revocations in the same process are picked up immediately)
+ASGI_REVOCATION_POLL_INTERVAL: int = settings.IMPERSONATE.get(
+    "ASGI_REVOCATION_POLL_INTERVAL", 10
+)
+
+# Set to True to notify ASGI connections of revocations from this process even
+# if it does not run EnforcePermissionWindowASGIMiddleware (e.g. WSGI workers
+# that serve the revoke view, when websockets are served by other processes)
+ASGI_REVOCATION_NOTIFY: bool = settings.IMPERSONATE.get("ASGI_REVOCATION_NOTIFY", False)
@@ -0,0 +1,21 @@
+from __future__ import annotations
+
+from typing import List, Type
+
+from django.db import models, transaction
+from django.dispatch import Signal
+
+# All signals are sent once the current transaction has been committed, with
+# a single `window_ids` kwarg containing the ids of every window affected.
+window_granted = Signal()
+window_revoked = Signal()
+window_expired = Signal()
+
+
+def send_on_commit(
+    signal: Signal, sender: Type[models.Model], window_ids: List[int]
+) -> None:
+    """Send signal for a batch of windows once the transaction commits."""
+    if not window_ids:
+        return
+    transaction.on_commit(lambda: signal.send(sender=sender, window_ids=window_ids))
@@ -0,0 +1,159 @@
+"""
+Message storage that renders impersonation messages lazily.
+
+The eager `add_message` renders each message template on every request, and
+stores the rendered string in the message storage. The storage classes in
+this module allow `add_message` to store only the template name and a minimal
+context (model ids and a handful of fields), and defer rendering until the
+message is iterated over for display.
+
+"""
+from __future__ import annotations
+
+import json
+import logging
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib.messages.storage.base import Message
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.contrib.messages.storage.fallback import FallbackStorage
+from django.contrib.messages.storage.session import SessionStorage
+from django.db import models
+from django.template.loader import render_to_string
+from django.utils.dateparse import parse_datetime
+
+from .profiling import profile_render
+
+logger = logging.getLogger(__name__)
+
+# message tag (in Message.extra_tags) used to identify lazy messages
+LAZY_MESSAGE_TAG = "impersonate_permissions_lazy"
+
+# the only templates that a lazy message may render
+LAZY_MESSAGE_TEMPLATES = frozenset(
+    f"impersonate_permissions/{name}.tpl"
+    for name in ("impersonating", "expired", "impersonated")
+)
+
+# model fields stored alongside the pk, keyed on model label - all other
+# fields are fetched from the database if (and only if) they are used.
+PRELOADED_FIELDS: Dict[str, Tuple[str, ...]] = {
+    "impersonate_permissions.PermissionWindow": ("window_ends_at",)
+}
+
+
+def is_lazy_message_model(label: Any) -> bool:
+    """Return True if a lazy message may load the model with this label."""
+    # compared in lowercase, as Django accepts any case for AUTH_USER_MODEL
+    allowed = ("impersonate_permissions.permissionwindow", settings.AUTH_USER_MODEL)
+    return isinstance(label, str) and label.lower() in [a.lower() for a in allowed]
+
+
+class ModelStub:
+    """Stand-in for a model instance that only hits the database on demand."""
+
+    def __init__(self, label: str, pk: Any, **fields: Any) -> None:
+        self._label = label
+        self._instance: Optional[models.Model] = None
+        self.pk = self.id = pk
+        self.__dict__.update(fields)
+
+    def __getattr__(self, name: str) -> Any:
+        # only called for attributes that have not been preloaded
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self._load(), name)
+
+    def __str__(self) -> str:
+        return str(self._load())
+
+    def _load(self) -> models.Model:
+        if self._instance is None:
+            model = apps.get_model(self._label)
+            self._instance = model.objects.get(pk=self.pk)
+        return self._instance
+
+
+def _serialize_value(value: Any) -> Any:
+    if not isinstance(value, models.Model):
+        return value
+    label = value._meta.label
+    fields = {
+        f: getattr(value, f).isoformat() for f in PRELOADED_FIELDS.get(label, ())
+    }
+    return {"model": label, "pk": value.pk, "fields": fields}
+
+
+def _deserialize_value(value: Any) -> Any:
+    if not (isinstance(value, dict) and "model" in value and "pk" in value):
+        return value
+    label = value["model"]
+    if not is_lazy_message_model(label):
+        raise ValueError(f"Model not allowed in lazy message: {label!r}")
+    preloaded = PRELOADED_FIELDS.get(label, ())
+    fields = {
+        k: parse_datetime(v) for k, v in value["fields"].items() if k in preloaded
+    }
+    return ModelStub(label, value["pk"], **fields)
+
+
+def encode_lazy_message(template: str, context: Optional[Dict[str, Any]]) -> str:
+    """Return compact string representation of a templated message."""
+    context = {k: _serialize_value(v) for k, v in (context or {}).items()}
+    return json.dumps([template, context], separators=(",", ":"))
+
+
+def render_lazy_message(message: str) -> str:
+    """
+    Render message stored using encode_lazy_message.
+
+    Raises ValueError if the message is malformed, or refers to a template
+    or model that lazy messages are not allowed to use.
+
+    """
+    try:
+        template, context = json.loads(message)
+        context = {k: _deserialize_value(v) for k, v in context.items()}
+    except (AttributeError, TypeError, ValueError) as ex:
+        raise ValueError(f"Invalid lazy message: {ex}") from ex
+    if template not in LAZY_MESSAGE_TEMPLATES:
+        raise ValueError(f"Template not allowed in lazy message: {template!r}")
+    return render_to_string(template, context=context)
+
+
+def is_lazy_message(message: Message) -> bool:
+    """Return True if message was added as a lazy message."""
+    return LAZY_MESSAGE_TAG in (message.extra_tags or "").split()
+
+
+class LazyMessageStorageMixin:
+    """Render lazy messages as they are iterated over."""
+
+    def __iter__(self) -> Iterator[Message]:
+        for message in super().__iter__():  # type: ignore
+            if is_lazy_message(message):
+                try:
+                    with profile_render(self.request):  # type: ignore
+                        message.message = render_lazy_message(message.message)
+                except ValueError:
+                    logger.warning("Discarding invalid lazy message", exc_info=True)
+                    continue
+                # rendered, so no longer lazy (and the tag is not for display)
+                message.extra_tags = " ".join(
+                    t for t in message.extra_tags.split() if t != LAZY_MESSAGE_TAG
+                )
+            yield message
+
+
+class LazyCookieStorage(LazyMessageStorageMixin, CookieStorage):
+    pass
+
+
+class LazySessionStorage(LazyMessageStorageMixin, SessionStorage):
+    pass
+
+
+class LazyFallbackStorage(LazyMessageStorageMixin, FallbackStorage):
+    pass
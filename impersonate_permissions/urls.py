@@ -0,0 +1,9 @@
+from django.urls import path
+
+from . import views
+
+urlpatterns = [
+    path("grant/", views.grant, name="impersonate-permissions-grant"),
+    path("revoke/", views.revoke, name="impersonate-permissions-revoke"),
+    path("status/", views.status, name="impersonate-permissions-status"),
+]
@@ -0,0 +1,82 @@
+from __future__ import annotations
+
+import functools
+from typing import Any, Callable, Dict, Optional
+
+from django.db import transaction
+from django.http import HttpRequest, HttpResponse, JsonResponse
+from django.views.decorators.http import condition, require_GET, require_POST
+
+from .models import PermissionWindow, get_active_window
+
+
+def json_login_required(
+    view_func: Callable[..., HttpResponse]
+) -> Callable[..., HttpResponse]:
+    """Return 401 (rather than redirect to the login page) if not logged in."""
+
+    @functools.wraps(view_func)
+    def wrapper(request: HttpRequest, *args: Any, **kwargs: Any) -> HttpResponse:
+        if not request.user.is_authenticated:
+            return JsonResponse({"error": "Authentication required."}, status=401)
+        return view_func(request, *args, **kwargs)
+
+    return wrapper
+
+
+def serialize_window(window: Optional[PermissionWindow]) -> Dict[str, Any]:
+    """Return JSON-serializable representation of a window."""
+    if window is None:
+        return {"window": None}
+    return {
+        "window": {
+            "id": window.id,
+            "window_starts_at": window.window_starts_at,
+            "window_ends_at": window.window_ends_at,
+            # always True - only active (and so enabled) windows are returned
+            "is_enabled": window.is_enabled,
+        }
+    }
+
+
+def _status_etag(request: HttpRequest) -> str:
+    # windows have no modified timestamp, so the ETag must cover every field
+    # that can be edited (e.g. window_ends_at, in the admin) - Last-Modified
+    # is not set, as created_at would not change when the window does. Only
+    # active windows are returned, so is_enabled is always True and omitted.
+    window = get_active_window(request)
+    if window is None:
+        return "none"
+    return f"{window.id}-{window.window_ends_at.timestamp()}"
+
+
+@json_login_required
+@require_POST
+def grant(request: HttpRequest) -> HttpResponse:
+    """Create a new PermissionWindow for the current user."""
+    # an impersonator must never be able to grant themselves consent
+    if request.user.is_impersonate:
+        return JsonResponse({"error": "Forbidden whilst impersonating."}, status=403)
+    window = PermissionWindow.objects.create(user=request.user)
+    return JsonResponse(serialize_window(window), status=201)
+
+
+@json_login_required
+@require_POST
+def revoke(request: HttpRequest) -> HttpResponse:
+    """Disable all active and recurring PermissionWindows for the current user."""
+    # revocation is the user's decision, not the impersonator's
+    if request.user.is_impersonate:
+        return JsonResponse({"error": "Forbidden whilst impersonating."}, status=403)
+    with transaction.atomic():
+        request.user.recurring_permission_windows.disable()
+        request.user.permission_windows.active().disable()
+    return JsonResponse(serialize_window(None))
+
+
+@json_login_required
+@require_GET
+@condition(etag_func=_status_etag)
+def status(request: HttpRequest) -> HttpResponse:
+    """Return the current user's active window, supporting conditional GET."""
+    return JsonResponse(serialize_window(get_active_window(request)))
@@ -0,0 +1,277 @@
+"""
+Concurrent load test for grant / impersonate / enforce / revoke cycles.
+
+Each worker thread plays a support agent, repeatedly picking a random user
+and then, via the Django test client (i.e. through the full middleware
+stack):
+
+    1. granting permission, as the user (POST impersonate-permissions-grant)
+    2. starting impersonation, as the agent (GET impersonate-start)
+    3. making an enforced request whilst impersonating (GET test_view)
+    4. revoking permission, as the user (POST impersonate-permissions-revoke)
+    5. making an enforced request after revocation (GET test_view)
+    6. stopping impersonation (GET impersonate-stop)
+
+Responses to the enforced requests that were served as the impersonated user
+are reported as e.g. "200 (impersonating)". After revocation these should
+only occur if another worker has granted permission again in the meantime.
+
+Users are shared between workers, so grants and revocations contend with
+each other. A monitor thread checks that no user ever has more than one
+active window, and reports the distinct users affected and the most seen
+at once. Run against a file-backed database, after migrating:
+
+    $ python manage.py migrate
+    $ python manage.py loadtest_permissions --workers 16 --users 50
+
+The concurrent mode is for manual runs only - the test suite runs a single
+worker smoke test, as the in-memory test database cannot be shared safely
+between threads.
+
+"""
+import logging
+import random
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection
+from django.db.models import Count
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from impersonate_permissions.models import PermissionWindow
+
+User = get_user_model()
+
+USERNAME_PREFIX = "loadtest-"
+
+STEPS = ("grant", "start", "enforce", "revoke", "enforce_revoked", "stop")
+
+
+def percentile(values, pct):
+    """Return the pct percentile of a sorted list of values."""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def violating_user_ids(users):
+    """Return ids of users with more than one active window."""
+    return set(
+        PermissionWindow.objects.active()
+        .filter(user__in=users)
+        # clear the ordering, which would otherwise be added to the GROUP BY
+        .order_by()
+        .values("user")
+        .annotate(windows=Count("id"))
+        .filter(windows__gt=1)
+        .values_list("user", flat=True)
+    )
+
+
+class LoadTest:
+    """Shared state and results for a single load test run."""
+
+    def __init__(self, users, agents, iterations):
+        self.users = users
+        self.agents = agents
+        self.iterations = iterations
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(Counter)
+        self.lock_errors = 0
+        self.errors = Counter()
+        # users seen with more than one active window, and the most at once
+        self.violating_users = set()
+        self.peak_violations = 0
+        self.done = threading.Event()
+
+    def request(self, step, client, method, path, impersonating=None):
+        """
+        Make request, recording latency, status and any errors.
+
+        If `impersonating` is set, responses served whilst impersonating that
+        user are recorded separately in the status codes.
+
+        """
+        start = time.perf_counter()
+        try:
+            response = getattr(client, method)(path)
+        except OperationalError as ex:
+            with self.lock:
+                if "lock" in str(ex).lower():
+                    self.lock_errors += 1
+                else:
+                    self.errors[f"{step}: {ex.__class__.__name__}"] += 1
+            return None
+        except Exception as ex:  # pylint: disable=broad-except
+            with self.lock:
+                self.errors[f"{step}: {ex.__class__.__name__}"] += 1
+            return None
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                self.latencies[step].append(elapsed)
+        status = str(response.status_code)
+        if impersonating and response.wsgi_request.user.pk == impersonating.pk:
+            status += " (impersonating)"
+        with self.lock:
+            self.statuses[step][status] += 1
+        return response
+
+    def worker(self, agent):
+        """Run grant / enforce / revoke cycles as agent."""
+        agent_client = Client()
+        agent_client.force_login(agent)
+        user_clients = {}
+        try:
+            for _ in range(self.iterations):
+                user = random.choice(self.users)  # noqa: S311
+                if user.pk not in user_clients:
+                    user_clients[user.pk] = Client()
+                    user_clients[user.pk].force_login(user)
+                user_client = user_clients[user.pk]
+                self.request("grant", user_client, "post", self.grant_url)
+                self.request(
+                    "start",
+                    agent_client,
+                    "get",
+                    reverse("impersonate-start", args=[user.pk]),
+                )
+                self.request("enforce", agent_client, "get", self.test_url, user)
+                self.request("revoke", user_client, "post", self.revoke_url)
+                self.request(
+                    "enforce_revoked", agent_client, "get", self.test_url, user
+                )
+                self.request("stop", agent_client, "get", self.stop_url)
+        finally:
+            connection.close()
+
+    def monitor(self, interval):
+        """Check for users with more than one active window."""
+        try:
+            while not self.done.wait(interval):
+                try:
+                    user_ids = violating_user_ids(self.users)
+                except OperationalError:
+                    continue
+                with self.lock:
+                    self.violating_users.update(user_ids)
+                    self.peak_violations = max(self.peak_violations, len(user_ids))
+        finally:
+            connection.close()
+
+    def run(self, interval):
+        """Run all workers to completion, return elapsed time."""
+        self.grant_url = reverse("impersonate-permissions-grant")
+        self.revoke_url = reverse("impersonate-permissions-revoke")
+        self.stop_url = reverse("impersonate-stop")
+        self.test_url = reverse("test_view")
+        monitor = threading.Thread(target=self.monitor, args=(interval,))
+        monitor.start()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=len(self.agents)) as executor:
+            list(executor.map(self.worker, self.agents))
+        elapsed = time.perf_counter() - start
+        self.done.set()
+        monitor.join()
+        return elapsed
+
+
+class Command(BaseCommand):
+
+    help = "Load test concurrent grant, enforce and revoke cycles."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers", type=int, default=8, help="Number of concurrent agents."
+        )
+        parser.add_argument(
+            "--users", type=int, default=20, help="Number of users to impersonate."
+        )
+        parser.add_argument(
+            "--iterations", type=int, default=20, help="Cycles per worker."
+        )
+        parser.add_argument(
+            "--monitor-interval",
+            type=float,
+            default=0.1,
+            help="Seconds between invariant checks.",
+        )
+        parser.add_argument(
+            "--keep", action="store_true", help="Do not delete load test users."
+        )
+
+    def handle(self, *args, **options):
+        self.cleanup()
+        users = [
+            User.objects.create(username=f"{USERNAME_PREFIX}user-{i}")
+            for i in range(options["users"])
+        ]
+        agents = [
+            User.objects.create(
+                username=f"{USERNAME_PREFIX}agent-{i}",
+                is_staff=True,
+                is_superuser=True,
+            )
+            for i in range(options["workers"])
+        ]
+        load_test = LoadTest(users, agents, options["iterations"])
+        allowed_hosts = list(settings.ALLOWED_HOSTS) + ["testserver"]
+        # failed requests are counted, so don't log each one
+        logging.disable(logging.ERROR)
+        try:
+            with override_settings(ALLOWED_HOSTS=allowed_hosts):
+                elapsed = load_test.run(options["monitor_interval"])
+            self.report(load_test, elapsed)
+        finally:
+            logging.disable(logging.NOTSET)
+            if not options["keep"]:
+                self.cleanup()
+
+    def cleanup(self):
+        User.objects.filter(username__startswith=USERNAME_PREFIX).delete()
+
+    def report(self, load_test, elapsed):
+        requests = sum(len(v) for v in load_test.latencies.values())
+        self.stdout.write(
+            f"{requests} requests in {elapsed:.2f}s "
+            f"({requests / elapsed:.1f} req/s) "
+            f"from {len(load_test.agents)} workers"
+        )
+        self.stdout.write(
+            f"{'step':<16} {'count':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}  "
+            "status codes"
+        )
+        for step in STEPS:
+            latencies = sorted(load_test.latencies[step])
+            p50, p95, p99 = (percentile(latencies, p) * 1000 for p in (50, 95, 99))
+            statuses = ", ".join(
+                f"{code}: {count}"
+                for code, count in sorted(load_test.statuses[step].items())
+            )
+            self.stdout.write(
+                f"{step:<16} {len(latencies):>6} {p50:>8.1f} {p95:>8.1f} {p99:>8.1f}  "
+                f"{statuses}"
+            )
+        self.stdout.write(f"Lock wait errors: {load_test.lock_errors}")
+        for error, count in load_test.errors.most_common():
+            self.stdout.write(f"Error ({error}): {count}")
+        # check once more, now that all of the workers have finished
+        user_ids = violating_user_ids(load_test.users)
+        violations = len(load_test.violating_users | user_ids)
+        peak = max(load_test.peak_violations, len(user_ids))
+        if violations:
+            self.stdout.write(
+                self.style.ERROR(
+                    f"Invariant violations (>1 active window per user): "
+                    f"{violations} users, peak {peak} at once"
+                )
+            )
+        else:
+            self.stdout.write(self.style.SUCCESS("Invariant violations: 0"))
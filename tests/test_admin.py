@@ -0,0 +1,90 @@
+from unittest import mock
+
+import pytest
+from django.contrib.auth import get_user_model
+from django.urls import reverse
+from django.utils import timezone
+
+from impersonate_permissions.models import PermissionWindow
+from impersonate_permissions.signals import window_granted, window_revoked
+
+User = get_user_model()
+
+
+@pytest.fixture
+def handler():
+    handler = mock.Mock()
+    window_granted.connect(handler)
+    window_revoked.connect(handler)
+    yield handler
+    window_granted.disconnect(handler)
+    window_revoked.disconnect(handler)
+
+
+def signals(handler):
+    return [(c[1]["signal"], c[1]["window_ids"]) for c in handler.call_args_list]
+
+
+def form_data(window):
+    starts_at = timezone.localtime(window.window_starts_at)
+    ends_at = timezone.localtime(window.window_ends_at)
+    return {
+        "user": window.user_id,
+        "window_starts_at_0": starts_at.strftime("%Y-%m-%d"),
+        "window_starts_at_1": starts_at.strftime("%H:%M:%S"),
+        "window_ends_at_0": ends_at.strftime("%Y-%m-%d"),
+        "window_ends_at_1": ends_at.strftime("%H:%M:%S"),
+        "is_enabled": "on" if window.is_enabled else "",
+        "recurrence": "",
+    }
+
+
+@pytest.mark.django_db(transaction=True)
+class TestPermissionWindowAdmin:
+    def test_add(self, admin_client, handler):
+        user = User.objects.create(username="user")
+        old_window = PermissionWindow.objects.create(user=user)
+        handler.reset_mock()
+        url = reverse("admin:impersonate_permissions_permissionwindow_add")
+        response = admin_client.post(url, form_data(PermissionWindow(user=user)))
+        assert response.status_code == 302
+        window = PermissionWindow.objects.exclude(id=old_window.id).get()
+        assert signals(handler) == [
+            (window_revoked, [old_window.id]),
+            (window_granted, [window.id]),
+        ]
+
+    def test_change__disable(self, admin_client, handler):
+        window = PermissionWindow.objects.create(user=User.objects.create(username="u"))
+        handler.reset_mock()
+        url = reverse(
+            "admin:impersonate_permissions_permissionwindow_change", args=[window.id]
+        )
+        data = form_data(window)
+        data["is_enabled"] = ""
+        response = admin_client.post(url, data)
+        assert response.status_code == 302
+        window.refresh_from_db()
+        assert not window.is_enabled
+        assert signals(handler) == [(window_revoked, [window.id])]
+
+    def test_change__other_field(self, admin_client, handler):
+        window = PermissionWindow.objects.create(user=User.objects.create(username="u"))
+        handler.reset_mock()
+        url = reverse(
+            "admin:impersonate_permissions_permissionwindow_change", args=[window.id]
+        )
+        response = admin_client.post(url, form_data(window))
+        assert response.status_code == 302
+        assert handler.call_count == 0
+
+    def test_delete(self, admin_client, handler):
+        window = PermissionWindow.objects.create(user=User.objects.create(username="u"))
+        handler.reset_mock()
+        url = reverse(
+            "admin:impersonate_permissions_permissionwindow_delete", args=[window.id]
+        )
+        response = admin_client.post(url, {"post": "yes"})
+        assert response.status_code == 302
+        assert not PermissionWindow.objects.exists()
+        assert signals(handler) == [(window_revoked, [window.id])]
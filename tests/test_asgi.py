@@ -0,0 +1,296 @@
+import asyncio
+import datetime
+from unittest import mock
+
+import pytest
+from asgiref.sync import async_to_sync, sync_to_async
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.utils import timezone
+
+from impersonate_permissions.asgi import (
+    CLOSE_CODE,
+    EnforcePermissionWindowASGIMiddleware,
+    notify_revoked,
+    revoked_cache_key,
+)
+from impersonate_permissions.models import PermissionWindow, RecurringPermissionWindow
+from impersonate_permissions.signals import window_revoked
+
+User = get_user_model()
+
+
+async def websocket_app(scope, receive, send):
+    """Accept the connection, then echo until disconnected."""
+    await receive()
+    await send({"type": "websocket.accept"})
+    while True:
+        message = await receive()
+        if message["type"] == "websocket.disconnect":
+            return
+        await send({"type": "websocket.send", "text": message["text"]})
+
+
+def run(middleware, scope, messages, timeout=2):
+    """Run ASGI app with messages, return messages sent."""
+    sent = []
+
+    async def _run():
+        queue = asyncio.Queue()
+        for message in messages:
+            queue.put_nowait(message)
+
+        async def send(message):
+            sent.append(message)
+
+        await asyncio.wait_for(middleware(scope, queue.get, send), timeout)
+
+    async_to_sync(_run)()
+    return sent
+
+
+@pytest.fixture(autouse=True)
+def disconnect_notify_revoked():
+    """Disconnect the receiver connected by each middleware instance."""
+    yield
+    window_revoked.disconnect(dispatch_uid="asgi_notify_revoked")
+
+
+@pytest.fixture
+def users():
+    admin = User.objects.create(username="admin", is_staff=True)
+    user = User.objects.create(username="user")
+    return admin, user
+
+
+def websocket_scope(admin, user):
+    return {"type": "websocket", "user": admin, "session": {"_impersonate": user.pk}}
+
+
+@pytest.mark.django_db
+class TestEnforcePermissionWindowASGIMiddleware:
+    def test_not_impersonating(self, users):
+        admin, _ = users
+        scope = {"type": "websocket", "user": admin, "session": {}}
+        middleware = EnforcePermissionWindowASGIMiddleware(websocket_app)
+        sent = run(
+            middleware,
+            scope,
+            [{"type": "websocket.connect"}, {"type": "websocket.disconnect"}],
+        )
+        assert sent == [{"type": "websocket.accept"}]
+
+    def test_http_ignored(self, users):
+        scopes = []
+
+        async def app(scope, receive, send):
+            scopes.append(scope)
+
+        middleware = EnforcePermissionWindowASGIMiddleware(app)
+        run(middleware, {"type": "http"}, [])
+        assert scopes == [{"type": "http"}]
+
+    def test_no_window(self, users):
+        middleware = EnforcePermissionWindowASGIMiddleware(websocket_app)
+        sent = run(middleware, websocket_scope(*users), [])
+        assert sent == [{"type": "websocket.close", "code": CLOSE_CODE}]
+
+    def test_active_window(self, users):
+        PermissionWindow.objects.create(user=users[1])
+        middleware = EnforcePermissionWindowASGIMiddleware(websocket_app)
+        sent = run(
+            middleware,
+            websocket_scope(*users),
+            [
+                {"type": "websocket.connect"},
+                {"type": "websocket.receive", "text": "hello"},
+                {"type": "websocket.disconnect"},
+            ],
+        )
+        assert sent == [
+            {"type": "websocket.accept"},
+            {"type": "websocket.send", "text": "hello"},
+        ]
+
+    def test_recurring_window(self, users):
+        """Test that the current occurrence is created if need be."""
+        RecurringPermissionWindow.objects.create(
+            user=users[1],
+            starts_at=timezone.now() - datetime.timedelta(days=1),
+            ends_at=timezone.now() + datetime.timedelta(days=1),
+            weekdays="0123456",
+            # midnight to midnight, so always active
+            daily_starts_at=datetime.time(0),
+            daily_ends_at=datetime.time(0),
+        )
+        middleware = EnforcePermissionWindowASGIMiddleware(websocket_app)
+        sent = run(
+            middleware,
+            websocket_scope(*users),
+            [{"type": "websocket.connect"}, {"type": "websocket.disconnect"}],
+        )
+        assert sent == [{"type": "websocket.accept"}]
+
+    def test_window_ends(self, users):
+        PermissionWindow.objects.create(
+            user=users[1],
+            window_ends_at=timezone.now() + datetime.timedelta(seconds=0.2),
+        )
+        received = []
+
+        async def app(scope, receive, send):
+            await websocket_app(scope, receive, send)
+            received.append(await receive())
+
+        middleware = EnforcePermissionWindowASGIMiddleware(app)
+        sent = run(middleware, websocket_scope(*users), [{"type": "websocket.connect"}])
+        assert sent == [
+            {"type": "websocket.accept"},
+            {"type": "websocket.close", "code": CLOSE_CODE},
+        ]
+        # the app is disconnected (so that it can clean up), not cancelled
+        assert received == [{"type": "websocket.disconnect", "code": CLOSE_CODE}]
+
+    @mock.patch("impersonate_permissions.asgi.DISCONNECT_TIMEOUT", 0.1)
+    def test_window_ends__app_ignores_disconnect(self, users):
+        PermissionWindow.objects.create(
+            user=users[1],
+            window_ends_at=timezone.now() + datetime.timedelta(seconds=0.2),
+        )
+        cancelled = []
+
+        async def app(scope, receive, send):
+            await receive()
+            await send({"type": "websocket.accept"})
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+
+        middleware = EnforcePermissionWindowASGIMiddleware(app)
+        sent = run(middleware, websocket_scope(*users), [{"type": "websocket.connect"}])
+        assert sent[-1] == {"type": "websocket.close", "code": CLOSE_CODE}
+        assert cancelled == [True]
+
+    def test_window_ends__http(self, users):
+        PermissionWindow.objects.create(
+            user=users[1],
+            window_ends_at=timezone.now() + datetime.timedelta(seconds=0.2),
+        )
+        received = []
+
+        async def app(scope, receive, send):
+            await send({"type": "http.response.start", "status": 200, "headers": []})
+            received.append(await receive())
+
+        scope = {**websocket_scope(*users), "type": "http"}
+        middleware = EnforcePermissionWindowASGIMiddleware(app, scope_types=("http",))
+        sent = run(middleware, scope, [])
+        assert sent == [
+            {"type": "http.response.start", "status": 200, "headers": []},
+            {"type": "http.response.body", "body": b"", "more_body": False},
+        ]
+        assert received == [{"type": "http.disconnect"}]
+
+    def test_cancelled(self, users):
+        """Test that the app and watcher are cancelled with the middleware."""
+        PermissionWindow.objects.create(user=users[1])
+        middleware = EnforcePermissionWindowASGIMiddleware(websocket_app)
+
+        async def _run():
+            queue = asyncio.Queue()
+            queue.put_nowait({"type": "websocket.connect"})
+
+            async def send(message):
+                pass
+
+            task = asyncio.ensure_future(
+                middleware(websocket_scope(*users), queue.get, send)
+            )
+            await asyncio.sleep(0.1)
+            before = asyncio.all_tasks() - {asyncio.current_task()}
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+            await asyncio.sleep(0.1)
+            after = asyncio.all_tasks() - {asyncio.current_task()}
+            return len(before), [t for t in after if not t.done()]
+
+        started, running = async_to_sync(_run)()
+        # the middleware, app, watcher and pending receive were running
+        assert started > 1
+        assert running == []
+
+    def test_window_revoked(self, users):
+        window = PermissionWindow.objects.create(user=users[1])
+
+        async def app(scope, receive, send):
+            await receive()
+            await send({"type": "websocket.accept"})
+            # revoke the window - signals are not sent within the test transaction
+            await sync_to_async(window.disable)()
+            await sync_to_async(notify_revoked)(None, window_ids=[window.id])
+            await receive()
+
+        middleware = EnforcePermissionWindowASGIMiddleware(app)
+        sent = run(middleware, websocket_scope(*users), [{"type": "websocket.connect"}])
+        assert sent == [
+            {"type": "websocket.accept"},
+            {"type": "websocket.close", "code": CLOSE_CODE},
+        ]
+        assert cache.get(revoked_cache_key(window.id))
+
+    @mock.patch("impersonate_permissions.asgi.ASGI_REVOCATION_POLL_INTERVAL", 0.1)
+    def test_window_revoked__cache(self, users):
+        window = PermissionWindow.objects.create(user=users[1])
+
+        async def app(scope, receive, send):
+            await receive()
+            await send({"type": "websocket.accept"})
+            # revoked in another process
+            await sync_to_async(window.disable)()
+            await sync_to_async(cache.set)(revoked_cache_key(window.id), True)
+            await receive()
+
+        middleware = EnforcePermissionWindowASGIMiddleware(app)
+        sent = run(middleware, websocket_scope(*users), [{"type": "websocket.connect"}])
+        assert sent[-1] == {"type": "websocket.close", "code": CLOSE_CODE}
+
+    def test_window_replaced(self, users):
+        """Test that a connection survives the window being replaced."""
+        window = PermissionWindow.objects.create(user=users[1])
+
+        async def app(scope, receive, send):
+            await receive()
+            await send({"type": "websocket.accept"})
+            await sync_to_async(PermissionWindow.objects.create)(user=users[1])
+            await sync_to_async(notify_revoked)(None, window_ids=[window.id])
+            await asyncio.sleep(0.1)
+            await send({"type": "websocket.send", "text": "still here"})
+
+        middleware = EnforcePermissionWindowASGIMiddleware(app)
+        sent = run(middleware, websocket_scope(*users), [{"type": "websocket.connect"}])
+        assert sent == [
+            {"type": "websocket.accept"},
+            {"type": "websocket.send", "text": "still here"},
+        ]
+
+
+@mock.patch("impersonate_permissions.asgi.cache")
+def test_notify_revoked__cache_error(mock_cache):
+    mock_cache.set_many.side_effect = ConnectionError()
+    notify_revoked(None, window_ids=[1])
+    mock_cache.set_many.assert_called_once()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_notify_revoked__connected(users):
+    cache.clear()
+    window = PermissionWindow.objects.create(user=users[1])
+    window.disable()
+    assert not cache.get(revoked_cache_key(window.id))
+    window = PermissionWindow.objects.create(user=users[1])
+    EnforcePermissionWindowASGIMiddleware(websocket_app)
+    window.disable()
+    assert cache.get(revoked_cache_key(window.id))
@@ -0,0 +1,42 @@
+from io import StringIO
+
+import pytest
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+
+from impersonate_permissions.models import PermissionWindow
+
+from .management.commands.loadtest_permissions import violating_user_ids
+
+User = get_user_model()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_loadtest_permissions():
+    # the test database is in-memory, so this is a single-worker smoke test
+    out = StringIO()
+    call_command(
+        "loadtest_permissions",
+        workers=1,
+        users=2,
+        iterations=2,
+        monitor_interval=60,
+        stdout=out,
+    )
+    output = out.getvalue()
+    assert "12 requests" in output
+    assert "200 (impersonating): 2" in output
+    assert "Lock wait errors: 0" in output
+    assert "Invariant violations: 0" in output
+    # load test users are deleted
+    assert not PermissionWindow.objects.exists()
+
+
+@pytest.mark.django_db
+def test_violating_user_ids():
+    users = [User.objects.create(username=f"user{i}") for i in range(3)]
+    # bypass the manager, which would disable the first window
+    PermissionWindow.objects.bulk_create(
+        [PermissionWindow(user=users[0]), PermissionWindow(user=users[0])]
+    )
+    assert violating_user_ids(users) == {users[0].id}
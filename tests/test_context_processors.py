@@ -1,10 +1,12 @@
 from unittest import mock
 
+import pytest
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import AnonymousUser
 from django.http import HttpRequest
 
 from impersonate_permissions.context_processors import impersonation
+from impersonate_permissions.models import PermissionWindow, get_active_window
 
 User = get_user_model()
 
@@ -17,6 +19,7 @@ def test_impersonation__false():
     assert context["is_impersonate"] is False
     assert context["impersonator"] is None
     assert context["impersonating"] is None
+    assert context["permission_window"] is None
 
 
 def test_impersonation__true():
@@ -37,3 +40,18 @@ def test_impersonation__anonymous():
     assert context["is_impersonate"] is False
     assert context["impersonator"] is None
     assert context["impersonating"] is None
+    assert context["permission_window"] is None
+
+
+@pytest.mark.django_db
+def test_impersonation__permission_window(django_assert_num_queries):
+    user = User.objects.create(username="user")
+    user.is_impersonate = True
+    window = PermissionWindow.objects.create(user=user)
+    request = mock.Mock(spec=HttpRequest, user=user, real_user=User())
+    with django_assert_num_queries(1):
+        # e.g. in the middleware
+        assert get_active_window(request) == window
+        context = impersonation(request)
+        assert context["permission_window"] == window
+        assert context["permission_window"].window_ends_at == window.window_ends_at
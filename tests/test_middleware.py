@@ -14,7 +14,7 @@ from impersonate_permissions.middleware import (
     ImpersonationAlertMiddleware,
     add_message,
 )
-from impersonate_permissions.models import PermissionWindow
+from impersonate_permissions.models import PermissionWindow, RecurringPermissionWindow
 from impersonate_permissions.settings import PERMISSION_EXPIRY_WARNING_INTERVAL
 
 User = get_user_model()
@@ -66,6 +66,31 @@ class TestEnforcePermissionWindowMiddleware:
             request, messages.INFO, "impersonating", context={"window": window}
         )
 
+    @mock.patch("impersonate_permissions.middleware.add_message")
+    def test_middleware__recurring(self, mock_msg):
+        """Test that recurring window occurrences are created on demand."""
+        from django.utils import timezone
+
+        user1 = User.objects.create(username="impersonator")
+        user2 = User.objects.create(username="impersonating")
+        user2.is_impersonate = True
+        now = timezone.localtime()
+        recurrence = RecurringPermissionWindow.objects.create(
+            user=user2,
+            ends_at=now + datetime.timedelta(days=1),
+            weekdays="0123456",
+            daily_starts_at=(now - datetime.timedelta(minutes=1)).time(),
+            daily_ends_at=(now + datetime.timedelta(minutes=1)).time(),
+        )
+        request = mock.Mock(spec=HttpRequest, path="/", user=user2, real_user=user1)
+        middleware = EnforcePermissionWindowMiddleware(lambda r: HttpResponse())
+        response = middleware(request)
+        assert response.status_code == 200
+        window = recurrence.windows.active().get()
+        mock_msg.assert_called_once_with(
+            request, messages.WARNING, "impersonating", context={"window": window}
+        )
+
     @mock.patch("impersonate_permissions.middleware.add_message")
     def test_middleware__expired(self, mock_msg):
         user1 = User.objects.create(username="impersonator")
@@ -81,6 +106,28 @@ class TestEnforcePermissionWindowMiddleware:
         assert response.url == reverse("impersonate-stop")
         mock_msg.assert_called_once_with(request, messages.INFO, "expired")
 
+    @mock.patch("impersonate_permissions.middleware.add_message")
+    def test_middleware__run_out(self, mock_msg):
+        from django.utils import timezone
+
+        user1 = User.objects.create(username="impersonator")
+        user2 = User.objects.create(username="impersonating")
+        user2.is_impersonate = True
+        now = timezone.now()
+        window = PermissionWindow.objects.create(
+            user=user2,
+            window_starts_at=now - datetime.timedelta(hours=2),
+            window_ends_at=now - datetime.timedelta(hours=1),
+        )
+        request = mock.Mock(spec=HttpRequest, path="/", user=user2, real_user=user1)
+        middleware = EnforcePermissionWindowMiddleware(lambda r: HttpResponse())
+        response = middleware(request)
+        assert response.status_code == 302
+        # expiry is left to PermissionWindow.objects.expire(), off the request path
+        window.refresh_from_db()
+        assert window.is_enabled
+        assert window.expired_at is None
+
 
 @pytest.mark.django_db
 class TestImpersonationAlertMiddleware:
@@ -4,14 +4,26 @@ from unittest import mock
 import freezegun
 import pytest
 from django.contrib.auth import get_user_model
+from django.core.exceptions import PermissionDenied
 from django.http import HttpRequest
 from django.utils import timezone
 
-from impersonate_permissions.models import PermissionWindow, users_impersonable
+from impersonate_permissions.models import (
+    PermissionWindow,
+    RecurringPermissionWindow,
+    get_active_window,
+    users_impersonable,
+    users_impersonable_cursor,
+    users_impersonable_page,
+)
 
 User = get_user_model()
 
 
+def local(*args):
+    return timezone.make_aware(datetime.datetime(*args))
+
+
 @pytest.mark.django_db
 @pytest.mark.parametrize(
     "start,end,enabled,exists",
@@ -37,6 +49,83 @@ def test_users_impersonable(start, end, enabled, exists):
     assert users_impersonable(request).exists() == exists
 
 
+@pytest.mark.django_db
+class TestUsersImpersonablePage:
+    @pytest.fixture
+    def users(self):
+        names = [
+            ("Fred", "Smith"),
+            ("Anne", "Smith"),
+            ("Anne", "Smith"),
+            ("Zoe", "Adams"),
+            ("Bob", "Jones"),
+        ]
+        users = []
+        for i, (first_name, last_name) in enumerate(names):
+            user = User.objects.create(
+                username=f"user{i}",
+                first_name=first_name,
+                last_name=last_name,
+                email=f"{first_name.lower()}{i}@example.com",
+            )
+            PermissionWindow.objects.create(user=user)
+            users.append(user)
+        # not impersonable
+        User.objects.create(username="Max", last_name="Adams")
+        return users
+
+    def test_pagination(self, users):
+        request = mock.Mock(spec=HttpRequest)
+        pages = []
+        after = None
+        while True:
+            page = list(users_impersonable_page(request, after=after)[:2])
+            if not page:
+                break
+            pages.append([u.username for u in page])
+            after = users_impersonable_cursor(page[-1])
+        assert pages == [["user3", "user4"], ["user1", "user2"], ["user0"]]
+
+    def test_pagination__leading_bound(self, users):
+        request = mock.Mock(spec=HttpRequest)
+        page = users_impersonable_page(request, after=("Jones", "Bob", users[4].pk))
+        # a plain range condition on last_name, ANDed with the cursor OR
+        assert '"last_name" >= Jones AND' in str(page.query)
+        assert [u.username for u in page] == ["user1", "user2", "user0"]
+
+    @pytest.mark.parametrize(
+        "search,usernames",
+        (
+            ("sm", ["user1", "user2", "user0"]),
+            ("ann", ["user1", "user2"]),
+            ("zoe3@", ["user3"]),
+            ("adams", ["user3"]),
+            ("mith", []),
+        ),
+    )
+    def test_search(self, users, search, usernames):
+        request = mock.Mock(spec=HttpRequest)
+        page = users_impersonable_page(request, search=search)
+        assert [u.username for u in page] == usernames
+
+
+@pytest.mark.django_db
+def test_get_active_window(django_assert_num_queries):
+    user = User.objects.create(username="Max")
+    window = PermissionWindow.objects.create(user=user)
+    request = mock.Mock(spec=HttpRequest, user=user)
+    with django_assert_num_queries(1):
+        assert get_active_window(request) == window
+        assert get_active_window(request) == window
+    window.disable()
+    with django_assert_num_queries(1):
+        assert get_active_window(request, refresh=True) is None
+    # cache is ignored if the request user changes
+    request.user = User.objects.create(username="Min")
+    with django_assert_num_queries(1):
+        assert get_active_window(request) is None
+
+
 @pytest.mark.django_db
 class TestPermissionWindowQuerySet:
     def test_active(self):
@@ -46,6 +135,37 @@ class TestPermissionWindowQuerySet:
         PermissionWindow(user=user).save()
         assert PermissionWindow.objects.active().count() == 2
 
+    def test_active_for_users(self, django_assert_num_queries):
+        user1 = User.objects.create(username="Max")
+        user2 = User.objects.create(username="Min")
+        PermissionWindow(user=user1).save()
+        pw2 = PermissionWindow(user=user1)
+        pw2.save()
+        with django_assert_num_queries(1):
+            windows = PermissionWindow.objects.active_for_users([user1.id, user2.id])
+        assert windows == {user1.id: pw2, user2.id: None}
+
+    def test_active_for_users__strings(self):
+        user = User.objects.create(username="Max")
+        window = PermissionWindow.objects.create(user=user)
+        # e.g. from request.POST.getlist()
+        windows = PermissionWindow.objects.require_active_for_users([str(user.id)])
+        assert windows == {user.id: window}
+
+    def test_require_active_for_users(self):
+        user1 = User.objects.create(username="Max")
+        user2 = User.objects.create(username="Min")
+        pw1 = PermissionWindow.objects.create(user=user1)
+        user_ids = [user1.id, user2.id]
+        with pytest.raises(PermissionDenied):
+            PermissionWindow.objects.require_active_for_users(user_ids)
+        assert PermissionWindow.objects.require_active_for_users(
+            user_ids, raise_exception=False
+        ) == {user1.id: pw1}
+        assert PermissionWindow.objects.require_active_for_users([user1.id]) == {
+            user1.id: pw1
+        }
+
     def test_disable(self):
         user = User.objects.create(username="Max")
         PermissionWindow(user=user).save()
@@ -66,6 +186,25 @@ class TestPermissionWindowManager:
         pw1.refresh_from_db()
         assert not pw1.is_active
 
+    @freezegun.freeze_time(local(2020, 7, 20, 10))
+    def test_create__recurring(self):
+        """Test that create method only disables overlapping occurrences."""
+        user = User.objects.create(username="Max")
+        recurrence = RecurringPermissionWindow.objects.create(
+            user=user,
+            ends_at=local(2020, 8, 20),
+            daily_starts_at=datetime.time(9),
+            daily_ends_at=datetime.time(17),
+        )
+        assert recurrence.materialize() == 6
+        window = PermissionWindow.objects.create(user=user)
+        assert PermissionWindow.objects.active().get() == window
+        recurrence.refresh_from_db()
+        assert recurrence.is_enabled
+        # today's occurrence is replaced, the rest of the week's are kept
+        assert not recurrence.windows.earliest("window_starts_at").is_enabled
+        assert recurrence.windows.filter(is_enabled=True).count() == 5
+
 
 class TestPermissionWindow:
     @pytest.mark.django_db
@@ -83,3 +222,171 @@ class TestPermissionWindow:
         now = timezone.now()
         with freezegun.freeze_time(now):
             assert pw.ttl == pw.window_ends_at - now
+
+
+@pytest.mark.django_db
+class TestRecurringPermissionWindow:
+    def recurrence(self, **kwargs):
+        user = User.objects.create(username="Max")
+        kwargs.setdefault("starts_at", local(2020, 7, 20))  # Monday
+        kwargs.setdefault("ends_at", local(2020, 10, 18))
+        kwargs.setdefault("daily_starts_at", datetime.time(9))
+        kwargs.setdefault("daily_ends_at", datetime.time(17))
+        return RecurringPermissionWindow.objects.create(user=user, **kwargs)
+
+    def test_occurrences(self):
+        recurrence = self.recurrence()
+        occurrences = list(
+            recurrence.occurrences(local(2020, 7, 20), local(2020, 7, 27))
+        )
+        assert occurrences == [
+            (local(2020, 7, day, 9), local(2020, 7, day, 17)) for day in range(20, 25)
+        ]
+
+    def test_occurrences__overnight(self):
+        recurrence = self.recurrence(
+            weekdays="0",
+            daily_starts_at=datetime.time(22),
+            daily_ends_at=datetime.time(6),
+        )
+        occurrences = list(
+            recurrence.occurrences(local(2020, 7, 20), local(2020, 7, 27))
+        )
+        assert occurrences == [(local(2020, 7, 20, 22), local(2020, 7, 21, 6))]
+
+    def test_occurrences__clipped(self):
+        recurrence = self.recurrence(
+            starts_at=local(2020, 7, 20, 12), ends_at=local(2020, 7, 21, 12)
+        )
+        occurrences = list(
+            recurrence.occurrences(local(2020, 7, 19), local(2020, 7, 27))
+        )
+        assert occurrences == [
+            (local(2020, 7, 20, 12), local(2020, 7, 20, 17)),
+            (local(2020, 7, 21, 9), local(2020, 7, 21, 12)),
+        ]
+
+    def test_occurrences__dst_skipped(self):
+        # clocks go forward from 02:00 to 03:00 in America/Chicago
+        recurrence = self.recurrence(
+            starts_at=local(2027, 3, 1),
+            ends_at=local(2027, 3, 31),
+            weekdays="6",
+            daily_starts_at=datetime.time(2, 30),
+            daily_ends_at=datetime.time(4),
+        )
+        occurrences = list(
+            recurrence.occurrences(local(2027, 3, 13), local(2027, 3, 15))
+        )
+        # 02:30 does not exist, so the occurrence starts at 03:30
+        assert occurrences == [
+            (local(2027, 3, 14, 3, 30), local(2027, 3, 14, 4)),
+        ]
+
+    def test_occurrences__dst_ambiguous(self):
+        # clocks go back from 02:00 to 01:00 in America/Chicago
+        recurrence = self.recurrence(
+            starts_at=local(2027, 11, 1),
+            ends_at=local(2027, 11, 30),
+            weekdays="6",
+            daily_starts_at=datetime.time(1, 30),
+            daily_ends_at=datetime.time(3),
+        )
+        occurrences = list(
+            recurrence.occurrences(local(2027, 11, 6), local(2027, 11, 8))
+        )
+        # 01:30 occurs twice, and the later (standard time) one is used
+        assert occurrences == [
+            (
+                timezone.make_aware(
+                    datetime.datetime(2027, 11, 7, 1, 30), is_dst=False
+                ),
+                local(2027, 11, 7, 3),
+            )
+        ]
+        assert occurrences[0][1] - occurrences[0][0] == datetime.timedelta(hours=1.5)
+
+    def test_occurrences__dst_overnight(self):
+        recurrence = self.recurrence(
+            starts_at=local(2027, 3, 1),
+            ends_at=local(2027, 3, 31),
+            weekdays="5",
+            daily_starts_at=datetime.time(22),
+            daily_ends_at=datetime.time(6),
+        )
+        occurrences = list(
+            recurrence.occurrences(local(2027, 3, 13), local(2027, 3, 15))
+        )
+        # the clocks go forward overnight, so the occurrence is an hour shorter
+        assert occurrences == [(local(2027, 3, 13, 22), local(2027, 3, 14, 6))]
+        assert occurrences[0][1] - occurrences[0][0] == datetime.timedelta(hours=7)
+
+    @freezegun.freeze_time(local(2027, 3, 13, 12))
+    def test_materialize__dst(self):
+        recurrence = self.recurrence(
+            starts_at=local(2027, 3, 1),
+            ends_at=local(2027, 3, 31),
+            weekdays="0123456",
+            daily_starts_at=datetime.time(2, 30),
+            daily_ends_at=datetime.time(4),
+        )
+        # 13th to 16th, including the skipped 02:30 on the 14th
+        assert recurrence.materialize(datetime.timedelta(days=3)) == 4
+        assert recurrence.windows.filter(
+            window_starts_at=local(2027, 3, 14, 3, 30)
+        ).exists()
+
+    @freezegun.freeze_time(local(2020, 7, 20, 10))
+    def test_materialize(self):
+        recurrence = self.recurrence()
+        # includes the occurrence that began at 9am today, and next Monday's
+        assert recurrence.materialize(datetime.timedelta(days=7)) == 6
+        assert recurrence.materialized_until == local(2020, 7, 27, 10)
+        assert recurrence.windows.count() == 6
+        assert PermissionWindow.objects.active().get().recurrence == recurrence
+        assert users_impersonable(mock.Mock(spec=HttpRequest)).exists()
+        # materializing again is a no-op until time moves on
+        assert recurrence.materialize(datetime.timedelta(days=7)) == 0
+        with freezegun.freeze_time(local(2020, 7, 27, 10)):
+            assert recurrence.materialize(datetime.timedelta(days=7)) == 5
+        assert recurrence.windows.count() == 11
+
+    @freezegun.freeze_time(local(2020, 7, 20, 10))
+    def test_materialize__overlap(self):
+        # a one-off window granted before the recurrence was created
+        window = PermissionWindow.objects.create(
+            user=User.objects.create(username="Max"),
+            window_ends_at=local(2020, 7, 21, 12),
+        )
+        recurrence = RecurringPermissionWindow.objects.create(
+            user=window.user,
+            starts_at=local(2020, 7, 20),
+            ends_at=local(2020, 10, 18),
+            daily_starts_at=datetime.time(9),
+            daily_ends_at=datetime.time(17),
+        )
+        # the current occurrence and tomorrow's overlap the one-off window
+        assert recurrence.materialize(datetime.timedelta(days=7)) == 4
+        assert PermissionWindow.objects.active().get() == window
+
+    @freezegun.freeze_time(local(2020, 10, 15, 10))
+    def test_materialize__ends(self):
+        recurrence = self.recurrence()
+        recurrence.materialize(datetime.timedelta(days=7))
+        assert recurrence.materialized_until == recurrence.ends_at
+        assert recurrence.windows.count() == 2
+
+    @freezegun.freeze_time(local(2020, 7, 20, 10))
+    def test_materialize__queryset(self):
+        self.recurrence()
+        assert RecurringPermissionWindow.objects.materialize() == 6
+        assert RecurringPermissionWindow.objects.materialize() == 0
+
+    @freezegun.freeze_time(local(2020, 7, 20, 10))
+    def test_disable(self):
+        recurrence = self.recurrence()
+        recurrence.materialize(datetime.timedelta(days=7))
+        recurrence.disable()
+        assert not PermissionWindow.objects.active().exists()
+        assert not recurrence.windows.filter(is_enabled=True).exists()
+        assert RecurringPermissionWindow.objects.materialize() == 0
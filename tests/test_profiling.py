@@ -0,0 +1,80 @@
+import json
+from unittest import mock
+
+import pytest
+from django.contrib.auth import get_user_model
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import HttpRequest, HttpResponse
+
+from impersonate_permissions.middleware import EnforcePermissionWindowMiddleware
+from impersonate_permissions.models import PermissionWindow
+from impersonate_permissions.profiling import (
+    PROFILE_HEADER,
+    PermissionsProfile,
+    ProfilePermissionsMiddleware,
+    get_profile,
+)
+
+User = get_user_model()
+
+
+def test_middleware__disabled():
+    with pytest.raises(MiddlewareNotUsed):
+        ProfilePermissionsMiddleware(lambda r: HttpResponse())
+
+
+def test_get_profile__disabled():
+    request = HttpRequest()
+    assert get_profile(request) is None
+
+
+@pytest.mark.django_db
+@mock.patch("impersonate_permissions.profiling.PROFILE_PERMISSIONS", True)
+class TestProfilePermissionsMiddleware:
+    @mock.patch("impersonate_permissions.middleware.messages.add_message")
+    def test_middleware(self, mock_add_message, settings):
+        settings.DEBUG = True
+        user1 = User.objects.create(username="impersonator")
+        user2 = User.objects.create(username="impersonating")
+        user2.is_impersonate = True
+        window = PermissionWindow.objects.create(user=user2)
+        request = mock.Mock(spec=HttpRequest, path="/", user=user2, real_user=user1)
+        middleware = ProfilePermissionsMiddleware(
+            EnforcePermissionWindowMiddleware(lambda r: HttpResponse())
+        )
+        response = middleware(request)
+        profile = get_profile(request)
+        assert isinstance(profile, PermissionsProfile)
+        assert [m["name"] for m in profile.middleware] == [
+            "EnforcePermissionWindowMiddleware"
+        ]
+        assert profile.window_id == window.id
+        assert profile.window_source == "database"
+        assert len(profile.queries) == 1
+        assert profile.render_time > 0
+        assert json.loads(response[PROFILE_HEADER])["window_id"] == window.id
+
+    @mock.patch("impersonate_permissions.middleware.messages.add_message")
+    def test_middleware__memo(self, mock_add_message):
+        user1 = User.objects.create(username="impersonator")
+        user2 = User.objects.create(username="impersonating")
+        user2.is_impersonate = True
+        window = PermissionWindow.objects.create(user=user2)
+        request = mock.Mock(spec=HttpRequest, path="/", user=user2, real_user=user1)
+        # the window has already been looked up for this request
+        request._permission_window = (user2.pk, window)
+        middleware = ProfilePermissionsMiddleware(
+            EnforcePermissionWindowMiddleware(lambda r: HttpResponse())
+        )
+        middleware(request)
+        profile = get_profile(request)
+        assert profile.window_id == window.id
+        assert profile.window_source == "request"
+        assert profile.queries == []
+
+    def test_middleware__no_header(self, settings):
+        settings.DEBUG = False
+        request = HttpRequest()
+        response = ProfilePermissionsMiddleware(lambda r: HttpResponse())(request)
+        assert get_profile(request) is not None
+        assert PROFILE_HEADER not in response
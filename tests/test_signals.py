@@ -0,0 +1,133 @@
+import datetime
+from unittest import mock
+
+import pytest
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.utils import timezone
+
+from impersonate_permissions.models import PermissionWindow, RecurringPermissionWindow
+from impersonate_permissions.signals import (
+    window_expired,
+    window_granted,
+    window_revoked,
+)
+
+User = get_user_model()
+
+
+@pytest.fixture
+def handler():
+    """Connect a mock handler to all three signals."""
+    handler = mock.Mock()
+    signals = (window_granted, window_revoked, window_expired)
+    for signal in signals:
+        signal.connect(handler)
+    yield handler
+    for signal in signals:
+        signal.disconnect(handler)
+
+
+def window_ids(handler, signal):
+    return [
+        c[1]["window_ids"] for c in handler.call_args_list if c[1]["signal"] == signal
+    ]
+
+
+@pytest.mark.django_db(transaction=True)
+class TestSignals:
+    def test_granted(self, handler):
+        user = User.objects.create(username="Max")
+        window = PermissionWindow.objects.create(user=user)
+        assert window_ids(handler, window_granted) == [[window.id]]
+        assert window_ids(handler, window_revoked) == []
+
+    def test_granted__replaces(self, handler):
+        user = User.objects.create(username="Max")
+        pw1 = PermissionWindow.objects.create(user=user)
+        pw2 = PermissionWindow.objects.create(user=user)
+        assert window_ids(handler, window_granted) == [[pw1.id], [pw2.id]]
+        assert window_ids(handler, window_revoked) == [[pw1.id]]
+
+    def test_granted__recurring(self, handler):
+        user = User.objects.create(username="Max")
+        now = timezone.now()
+        recurrence = RecurringPermissionWindow.objects.create(
+            user=user,
+            starts_at=now,
+            ends_at=now + datetime.timedelta(days=3),
+            weekdays="0123456",
+            daily_starts_at=datetime.time(0),
+            daily_ends_at=datetime.time(23, 59),
+        )
+        assert recurrence.materialize(datetime.timedelta(days=1)) > 0
+        assert window_ids(handler, window_granted) == [
+            list(recurrence.windows.order_by("id").values_list("id", flat=True))
+        ]
+
+    def test_revoked__batched(self, handler):
+        users = [User.objects.create(username=f"user{i}") for i in range(3)]
+        windows = [PermissionWindow.objects.create(user=u) for u in users]
+        handler.reset_mock()
+        PermissionWindow.objects.all().disable()
+        assert handler.call_count == 1
+        assert sorted(window_ids(handler, window_revoked)[0]) == sorted(
+            w.id for w in windows
+        )
+
+    def test_revoked__already_disabled(self, handler):
+        user = User.objects.create(username="Max")
+        PermissionWindow.objects.create(user=user, is_enabled=False)
+        handler.reset_mock()
+        PermissionWindow.objects.all().disable()
+        assert handler.call_count == 0
+
+    def test_revoked__instance(self, handler):
+        user = User.objects.create(username="Max")
+        window = PermissionWindow.objects.create(user=user)
+        window.disable()
+        assert window_ids(handler, window_revoked) == [[window.id]]
+
+    def test_rollback(self, handler):
+        user = User.objects.create(username="Max")
+        with pytest.raises(ValueError):
+            with transaction.atomic():
+                PermissionWindow.objects.create(user=user)
+                raise ValueError()
+        assert handler.call_count == 0
+
+    def test_expired(self, handler):
+        user = User.objects.create(username="Max")
+        now = timezone.now()
+        window = PermissionWindow.objects.create(
+            user=user,
+            window_starts_at=now - datetime.timedelta(hours=2),
+            window_ends_at=now - datetime.timedelta(hours=1),
+        )
+        PermissionWindow.objects.create(user=user, window_starts_at=now)
+        handler.reset_mock()
+        PermissionWindow.objects.expire()
+        assert window_ids(handler, window_expired) == [[window.id]]
+        # expiry is recorded separately from revocation
+        window.refresh_from_db()
+        assert window.is_enabled
+        assert window.expired_at is not None
+        # expiring again is a no-op
+        handler.reset_mock()
+        PermissionWindow.objects.expire()
+        assert handler.call_count == 0
+
+    def test_expired__revoked(self, handler):
+        user = User.objects.create(username="Max")
+        now = timezone.now()
+        window = PermissionWindow.objects.create(
+            user=user,
+            window_starts_at=now - datetime.timedelta(hours=2),
+            window_ends_at=now - datetime.timedelta(hours=1),
+        )
+        window.disable()
+        handler.reset_mock()
+        PermissionWindow.objects.expire()
+        assert handler.call_count == 0
+        window.refresh_from_db()
+        assert window.expired_at is None
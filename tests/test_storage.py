@@ -0,0 +1,118 @@
+import json
+
+import pytest
+from django.contrib import messages
+from django.contrib.auth import get_user_model
+from django.http import HttpResponse
+from django.contrib.messages.storage.base import Message
+from django.template.loader import render_to_string
+from django.test import RequestFactory
+
+from impersonate_permissions.middleware import add_message
+from impersonate_permissions.models import PermissionWindow
+from impersonate_permissions.storage import (
+    LAZY_MESSAGE_TAG,
+    LazyCookieStorage,
+    ModelStub,
+    encode_lazy_message,
+    is_lazy_message_model,
+    render_lazy_message,
+)
+
+User = get_user_model()
+
+TEMPLATE = "impersonate_permissions/impersonating.tpl"
+
+
+@pytest.mark.django_db
+class TestLazyMessages:
+    def test_encode(self):
+        user = User.objects.create(username="Max")
+        window = PermissionWindow.objects.create(user=user)
+        message = encode_lazy_message(TEMPLATE, {"window": window})
+        assert render_lazy_message(message) == render_to_string(
+            TEMPLATE, context={"window": window}
+        )
+
+    def test_model_stub(self, django_assert_num_queries):
+        user = User.objects.create(username="Max")
+        stub = ModelStub("tests.User", user.pk)
+        with django_assert_num_queries(0):
+            assert stub.id == user.id
+        with django_assert_num_queries(1):
+            assert stub.username == "Max"
+            assert str(stub) == str(user)
+
+    def test_cookie_storage(self, django_assert_num_queries):
+        user = User.objects.create(username="Max")
+        window = PermissionWindow.objects.create(user=user)
+        request = RequestFactory().get("/")
+        request._messages = LazyCookieStorage(request)
+        add_message(request, messages.INFO, "impersonating", {"window": window})
+        response = HttpResponse()
+        request._messages.update(response)
+        cookie = response.cookies[LazyCookieStorage.cookie_name]
+        assert TEMPLATE in cookie.value
+
+        # display the message on the next request
+        request = RequestFactory().get("/")
+        request.COOKIES[LazyCookieStorage.cookie_name] = cookie.value
+        storage = LazyCookieStorage(request)
+        with django_assert_num_queries(0):
+            rendered = [(str(m), m.tags) for m in storage]
+        assert rendered == [
+            (render_to_string(TEMPLATE, context={"window": window}), "info")
+        ]
+
+    def test_cookie_storage__not_lazy(self):
+        # messages are only rendered if they were added as lazy messages
+        message = encode_lazy_message(TEMPLATE, {})
+        request = RequestFactory().get("/")
+        storage = LazyCookieStorage(request)
+        storage.add(messages.INFO, message)
+        assert [m.message for m in storage] == [message]
+
+    @pytest.mark.parametrize(
+        "message",
+        [
+            "not json",
+            "[]",
+            '["impersonate_permissions/impersonating.tpl", []]',
+            json.dumps(["django/forms/widgets/input.html", {}]),
+            json.dumps(
+                [TEMPLATE, {"window": {"model": "auth.Group", "pk": 1, "fields": {}}}]
+            ),
+        ],
+    )
+    def test_render__invalid(self, message):
+        request = RequestFactory().get("/")
+        storage = LazyCookieStorage(request)
+        storage._queued_messages = [
+            Message(messages.INFO, message, extra_tags=LAZY_MESSAGE_TAG),
+            Message(messages.INFO, "Hello"),
+        ]
+        assert [m.message for m in storage] == ["Hello"]
+
+    @pytest.mark.parametrize("label", ["tests.User", "tests.user", "TESTS.USER"])
+    def test_is_lazy_message_model(self, settings, label):
+        assert is_lazy_message_model("impersonate_permissions.PermissionWindow")
+        settings.AUTH_USER_MODEL = label
+        assert is_lazy_message_model("tests.User")
+        assert not is_lazy_message_model("auth.Group")
+        assert not is_lazy_message_model(None)
+
+    def test_render__preloaded_fields_only(self):
+        user = User.objects.create(username="Max")
+        window = PermissionWindow.objects.create(user=user)
+        value = {
+            "model": "impersonate_permissions.PermissionWindow",
+            "pk": window.pk,
+            "fields": {
+                "window_ends_at": window.window_ends_at.isoformat(),
+                "_label": "auth.Group",
+            },
+        }
+        message = json.dumps([TEMPLATE, {"window": value}])
+        assert render_lazy_message(message) == render_to_string(
+            TEMPLATE, context={"window": window}
+        )
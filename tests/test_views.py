@@ -0,0 +1,139 @@
+import datetime
+
+import freezegun
+import pytest
+from django.contrib.auth import get_user_model
+from django.urls import reverse
+from django.utils import timezone
+
+from impersonate_permissions.models import PermissionWindow, RecurringPermissionWindow
+
+User = get_user_model()
+
+
+def etag(window):
+    return f"{window.id}-{window.window_ends_at.timestamp()}"
+
+
+@pytest.fixture
+def user():
+    return User.objects.create(username="user")
+
+
+@pytest.mark.django_db
+class TestGrantView:
+    def test_grant(self, client, user):
+        client.force_login(user)
+        response = client.post(reverse("impersonate-permissions-grant"))
+        assert response.status_code == 201
+        window = user.permission_windows.active().get()
+        assert response.json()["window"]["id"] == window.id
+
+    def test_grant__get(self, client, user):
+        client.force_login(user)
+        response = client.get(reverse("impersonate-permissions-grant"))
+        assert response.status_code == 405
+
+    def test_grant__anonymous(self, client):
+        response = client.post(reverse("impersonate-permissions-grant"))
+        assert response.status_code == 401
+        assert response.json() == {"error": "Authentication required."}
+        assert not PermissionWindow.objects.exists()
+
+    def test_grant__impersonating(self, client, user):
+        admin = User.objects.create(username="admin", is_staff=True, is_superuser=True)
+        PermissionWindow.objects.create(user=user)
+        client.force_login(admin)
+        client.get(reverse("impersonate-start", args=[user.pk]))
+        response = client.post(reverse("impersonate-permissions-grant"))
+        assert response.status_code == 403
+        assert PermissionWindow.objects.count() == 1
+
+
+@pytest.mark.django_db
+class TestRevokeView:
+    def test_revoke(self, client, user):
+        PermissionWindow.objects.create(user=user)
+        client.force_login(user)
+        response = client.post(reverse("impersonate-permissions-revoke"))
+        assert response.status_code == 200
+        assert response.json() == {"window": None}
+        assert not user.permission_windows.active().exists()
+
+    @freezegun.freeze_time("2020-07-20 15:00")  # Monday, 10am in Chicago
+    def test_revoke__recurring(self, client, user):
+        recurrence = RecurringPermissionWindow.objects.create(
+            user=user,
+            ends_at=timezone.now() + datetime.timedelta(days=30),
+            daily_starts_at=datetime.time(9),
+            daily_ends_at=datetime.time(17),
+        )
+        recurrence.materialize()
+        client.force_login(user)
+        response = client.post(reverse("impersonate-permissions-revoke"))
+        assert response.status_code == 200
+        recurrence.refresh_from_db()
+        assert not recurrence.is_enabled
+        assert not user.permission_windows.filter(is_enabled=True).exists()
+        assert RecurringPermissionWindow.objects.materialize() == 0
+
+    def test_revoke__impersonating(self, client, user):
+        admin = User.objects.create(username="admin", is_staff=True, is_superuser=True)
+        PermissionWindow.objects.create(user=user)
+        client.force_login(admin)
+        client.get(reverse("impersonate-start", args=[user.pk]))
+        response = client.post(reverse("impersonate-permissions-revoke"))
+        assert response.status_code == 403
+        assert user.permission_windows.active().exists()
+
+
+@pytest.mark.django_db
+class TestStatusView:
+    def test_status__none(self, client, user):
+        client.force_login(user)
+        response = client.get(reverse("impersonate-permissions-status"))
+        assert response.status_code == 200
+        assert response.json() == {"window": None}
+        assert response["ETag"] == '"none"'
+        assert "Last-Modified" not in response
+
+    def test_status__anonymous(self, client):
+        response = client.get(reverse("impersonate-permissions-status"))
+        assert response.status_code == 401
+
+    def test_status(self, client, user):
+        window = PermissionWindow.objects.create(user=user)
+        client.force_login(user)
+        response = client.get(reverse("impersonate-permissions-status"))
+        assert response.status_code == 200
+        assert response.json()["window"]["id"] == window.id
+        assert response["ETag"] == f'"{etag(window)}"'
+        assert "Last-Modified" not in response
+
+    def test_status__not_modified(self, client, user):
+        window = PermissionWindow.objects.create(user=user)
+        client.force_login(user)
+        url = reverse("impersonate-permissions-status")
+        response = client.get(url, HTTP_IF_NONE_MATCH=f'"{etag(window)}"')
+        assert response.status_code == 304
+        assert response.content == b""
+
+    def test_status__revoked(self, client, user):
+        window = PermissionWindow.objects.create(user=user)
+        window.disable()
+        client.force_login(user)
+        url = reverse("impersonate-permissions-status")
+        response = client.get(url, HTTP_IF_NONE_MATCH=f'"{etag(window)}"')
+        assert response.status_code == 200
+        assert response.json() == {"window": None}
+
+    def test_status__window_ends_at_changed(self, client, user):
+        window = PermissionWindow.objects.create(user=user)
+        old_etag = etag(window)
+        window.window_ends_at += datetime.timedelta(minutes=30)
+        window.save()
+        client.force_login(user)
+        url = reverse("impersonate-permissions-status")
+        response = client.get(url, HTTP_IF_NONE_MATCH=f'"{old_etag}"')
+        assert response.status_code == 200
+        assert response["ETag"] == f'"{etag(window)}"'
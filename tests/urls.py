@@ -8,5 +8,6 @@ admin.autodiscover()
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("impersonate/", include("impersonate.urls")),
+    path("permissions/", include("impersonate_permissions.urls")),
     path("test/", test_view, name="test_view"),
 ]